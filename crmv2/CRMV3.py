@@ -33,6 +33,12 @@ AADHAR_DIR = os.path.join(UPLOAD_DIR, "aadhar_cards")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(AADHAR_DIR, exist_ok=True)
 
+# crm.py moves this data into crm_data.db on its first start and renames the
+# JSON file - this edition would only be working on a copy nobody else sees
+if os.path.exists(f"{DATA_FILE}.migrated") or os.path.exists("crm_data.db"):
+    st.error("❌ The CRM data has moved to crm_data.db. Please run crm.py instead: streamlit run crmv2/crm.py")
+    st.stop()
+
 # Theme colors
 PRIMARY_COLOR = "#800020"
 SECONDARY_COLOR = "#a0153e"
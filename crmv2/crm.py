@@ -6,15 +6,32 @@ import streamlit as st
 import streamlit.components.v1 as components
 import json
 import os
+import shutil
+import io
+import csv
 from datetime import datetime, timedelta, date
 import bcrypt
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from io import BytesIO
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional, NamedTuple, Callable
 import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, Side
 import base64
+import bisect
+from urllib.parse import quote
+import hashlib
+import socket
+from collections import OrderedDict
 
 # ====================
 # CONFIGURATION
@@ -28,10 +45,14 @@ st.set_page_config(
 
 # File paths
 DATA_FILE = "crm_data.json"
+MIGRATED_DATA_FILE = "crm_data.json.migrated"
+DB_FILE = "crm_data.db"
 UPLOAD_DIR = "uploads"
 AADHAR_DIR = os.path.join(UPLOAD_DIR, "aadhar_cards")
+EXPORT_DIR = os.path.join(UPLOAD_DIR, "exports")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(AADHAR_DIR, exist_ok=True)
+os.makedirs(EXPORT_DIR, exist_ok=True)
 
 # Theme colors
 PRIMARY_COLOR = "#800020"
@@ -64,70 +85,906 @@ STATUS_LABELS = {
 
 
 # ====================
-# DATA FUNCTIONS - ✅ FIXED: Removed caching for real-time updates
+# STORAGE ENGINE - SQLite (WAL mode), one table per collection
 # ====================
+# Each list collection is stored one row per record, keyed by its ID field, so
+# a page that touches one record reads and writes only that row. Small
+# top-level values (dashboard settings, customers) live in the kv_store table.
+# Every write also appends to change_log, an append-only journal of
+# (collection, pk, op) that is compacted every JOURNAL_COMPACT_EVERY entries.
+# Rows carry a version number that is bumped on every update; passing the
+# version a page loaded makes the update compare-and-swap (optimistic locking).
+# Across worker processes SQLite is the reader/writer lock: writers serialize
+# on BEGIN IMMEDIATE, while readers never block and always see whole commits.
+COLLECTION_KEYS = {
+    "users": "username",
+    "leads": "customer_id",
+    "customer_leads": "lead_id",
+    "insurance_entries": "entry_id",
+    "reliant_best_entries": "entry_id",
+    "credits_fin_entries": "entry_id",
+    "bids": "bid_id",
+}
 
-def load_data() -> Dict[str, Any]:
-    """Load data from JSON file with proper initialization - NO CACHING"""
-    default = {
-        "users": {},
-        "customers": {},
-        "leads": [],
-        "customer_leads": [],
-        "insurance_entries": [],
-        "reliant_best_entries": [],
-        "dashboard": {
-            "text": "Welcome to Reliant Central. Please login to continue.",
-            "image_path": None
-        },
-        "credits_fin_entries": [],
-        "bids": [],
-    }
+# ID prefix -> (collection, field, zero-padded width) for allocated record IDs
+ID_SEQUENCES = {
+    "LEAD-": ("customer_leads", "lead_id", 4),
+    "INS-": ("insurance_entries", "entry_id", 4),
+    "INSC-": ("insurance_entries", "customer_id", 5),
+    "RBE-": ("reliant_best_entries", "entry_id", 6),
+    "CF-": ("credits_fin_entries", "entry_id", 5),
+    "BID-": ("bids", "bid_id", 5),
+}
 
-    if os.path.exists(DATA_FILE):
-        try:
+SCHEMA_VERSION = 7
+JOURNAL_COMPACT_EVERY = 500
+JOURNAL_RETENTION = 20000
+
+_db_local = threading.local()
+
+
+class WriteConflictError(Exception):
+    """A record changed after the caller loaded it, so the update was not applied"""
+
+    def __init__(self, collection: str, pk: str):
+        super().__init__(f"{pk} was changed by another user while you were viewing it. "
+                         f"Please review the latest version and try again.")
+        self.collection = collection
+        self.pk = pk
+
+
+class RecordKeyError(Exception):
+    """Records without a usable ID, or sharing one, that cannot be stored one row per ID"""
+
+    def __init__(self, collection: str, problems: List[str]):
+        shown = "; ".join(problems[:10]) + (f"; and {len(problems) - 10} more" if len(problems) > 10 else "")
+        super().__init__(f"Cannot store {collection}: {shown}. "
+                         f"Give each record a unique {COLLECTION_KEYS[collection]} and try again.")
+        self.collection = collection
+        self.problems = problems
+
+
+def get_connection() -> sqlite3.Connection:
+    """Return this thread's SQLite connection, creating the schema on first use"""
+    conn = getattr(_db_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(DB_FILE, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _init_schema(conn)
+        _wal_keeper()
+        _db_local.conn = conn
+    return conn
+
+
+@st.cache_resource
+def _wal_keeper() -> sqlite3.Connection:
+    """Connection held for the process lifetime
+
+    Each rerun runs on a new thread with its own connection; without this, the
+    last one closing checkpoints and deletes the WAL, which the snapshot cache
+    would mistake for a write."""
+    conn = sqlite3.connect(DB_FILE, check_same_thread=False)
+    conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+    return conn
+
+
+@contextmanager
+def write_transaction(conn: sqlite3.Connection):
+    """Run a block of writes as one atomic transaction"""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+def _encode(record: Any) -> str:
+    return json.dumps(record, default=str)
+
+
+def _record_pk(collection: str, record: Dict[str, Any]) -> str:
+    return str(record.get(COLLECTION_KEYS[collection]))
+
+
+def _init_schema(conn: sqlite3.Connection):
+    """Create or upgrade tables and import the legacy JSON file into a new database"""
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+        return
+
+    imported = False
+    with write_transaction(conn):
+        # Re-check under the write lock in case another worker got here first
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            return
+
+        for name in COLLECTION_KEYS:
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {name} ("
+                "id INTEGER PRIMARY KEY, pk TEXT NOT NULL UNIQUE, data TEXT NOT NULL, "
+                "version INTEGER NOT NULL DEFAULT 1)"
+            )
+            columns = {row[1] for row in conn.execute(f"PRAGMA table_info({name})")}
+            if "version" not in columns:
+                conn.execute(f"ALTER TABLE {name} ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+        conn.execute("CREATE TABLE IF NOT EXISTS kv_store (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS change_log ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, collection TEXT NOT NULL, pk TEXT NOT NULL, "
+            "op TEXT NOT NULL, changed_at TEXT NOT NULL)"
+        )
+        conn.execute("CREATE TABLE IF NOT EXISTS id_sequences (prefix TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS export_jobs ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, owner TEXT NOT NULL, collection TEXT NOT NULL, "
+            "format TEXT NOT NULL, spec TEXT NOT NULL, status TEXT NOT NULL, progress REAL NOT NULL DEFAULT 0, "
+            "rows INTEGER, path TEXT, error TEXT, created_at TEXT NOT NULL, finished_at TEXT, "
+            "worker TEXT, heartbeat REAL)"
+        )
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(export_jobs)")}
+        for column, kind in (("worker", "TEXT"), ("heartbeat", "REAL")):
+            if column not in columns:
+                conn.execute(f"ALTER TABLE export_jobs ADD COLUMN {column} {kind}")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS audit_log ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, at TEXT NOT NULL, actor TEXT, role TEXT, "
+            "collection TEXT NOT NULL, pk TEXT NOT NULL, action TEXT NOT NULL, source TEXT, target TEXT)"
+        )
+        for op in ("UPDATE", "DELETE"):
+            conn.execute(
+                f"CREATE TRIGGER IF NOT EXISTS audit_log_no_{op.lower()} BEFORE {op} ON audit_log "
+                "BEGIN SELECT RAISE(ABORT, 'audit_log is append-only'); END"
+            )
+
+        if version == 0 and os.path.exists(DATA_FILE):
             with open(DATA_FILE, "r") as f:
-                data = json.load(f)
-        except Exception as e:
-            st.error(f"Error loading data: {e}")
-            return default
+                legacy = json.load(f)
+            _import_legacy(conn, legacy)
+            imported = True
+
+        _seed_sequences(conn)
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    if imported:
+        # The older editions (V_4.py, CRMV3.py) still use the JSON file; renaming
+        # it keeps them from carrying on with a copy that no longer changes
+        try:
+            os.replace(DATA_FILE, MIGRATED_DATA_FILE)
+        except OSError:
+            pass
+
+
+def _seed_sequences(conn: sqlite3.Connection):
+    """Start each ID counter at the highest number already in use (one-time scan)"""
+    for prefix, (collection, field, _) in ID_SEQUENCES.items():
+        last_id = 0
+        for (raw,) in conn.execute(f"SELECT data FROM {collection}"):
+            try:
+                last_id = max(last_id, int(str(json.loads(raw).get(field, "")).replace(prefix, "")))
+            except ValueError:
+                continue
+        conn.execute("INSERT OR IGNORE INTO id_sequences (prefix, value) VALUES (?, ?)", (prefix, last_id))
+
+
+def next_id(prefix: str) -> str:
+    """Allocate the next ID for ``prefix`` - atomic across sessions and processes, never reused"""
+    conn = get_connection()
+    with write_transaction(conn):
+        conn.execute("INSERT OR IGNORE INTO id_sequences (prefix, value) VALUES (?, 0)", (prefix,))
+        conn.execute("UPDATE id_sequences SET value = value + 1 WHERE prefix = ?", (prefix,))
+        value = conn.execute("SELECT value FROM id_sequences WHERE prefix = ?", (prefix,)).fetchone()[0]
+    return f"{prefix}{str(value).zfill(ID_SEQUENCES[prefix][2])}"
+
+
+def _journal(conn: sqlite3.Connection, collection: str, pk: str, op: str):
+    """Append one entry to the change journal (inside the caller's transaction)"""
+    conn.execute(
+        "INSERT INTO change_log (collection, pk, op, changed_at) VALUES (?, ?, ?, ?)",
+        (collection, str(pk), op, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    )
+
+
+def journal_head() -> int:
+    """Sequence number of the latest journal entry (0 for an empty journal)"""
+    row = get_connection().execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_log'").fetchone()
+    return row[0] if row else 0
+
+
+def changes_since(seq: int) -> Optional[List[tuple]]:
+    """Return (seq, collection, pk, op) entries after ``seq``.
+
+    Returns None when compaction has already dropped entries the caller
+    needs, in which case it has to fall back to a full reload.
+    """
+    conn = get_connection()
+    floor = conn.execute("SELECT value FROM kv_store WHERE key = '_journal_floor'").fetchone()
+    if floor and seq < json.loads(floor[0]):
+        return None
+    return conn.execute(
+        "SELECT seq, collection, pk, op FROM change_log WHERE seq > ? ORDER BY seq", (seq,)
+    ).fetchall()
+
+
+def compact_journal(conn: sqlite3.Connection):
+    """Drop superseded journal entries and checkpoint the WAL.
+
+    Only the newest entry per record is kept, so "what changed since seq N"
+    stays answerable; entries older than JOURNAL_RETENTION are dropped and
+    the cut-off is recorded so readers that far behind reload instead.
+    """
+    with write_transaction(conn):
+        conn.execute(
+            "DELETE FROM change_log WHERE seq NOT IN "
+            "(SELECT MAX(seq) FROM change_log GROUP BY collection, pk)"
+        )
+        head = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_log'").fetchone()
+        floor = (head[0] if head else 0) - JOURNAL_RETENTION
+        if floor > 0:
+            conn.execute("DELETE FROM change_log WHERE seq <= ?", (floor,))
+            conn.execute(
+                "INSERT INTO kv_store (key, value) VALUES ('_journal_floor', ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (json.dumps(floor),)
+            )
+    conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+
+def _after_write(conn: sqlite3.Connection, head_before: int):
+    """Invalidate the load cache and compact the journal on JOURNAL_COMPACT_EVERY boundaries"""
+    invalidate_load_cache()
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_log'").fetchone()
+    head = row[0] if row else 0
+    if head // JOURNAL_COMPACT_EVERY > head_before // JOURNAL_COMPACT_EVERY:
+        compact_journal(conn)
+
+
+def _check_record_keys(collection: str, records: List[Dict[str, Any]]):
+    """Raise RecordKeyError if any record lacks its ID field or shares an ID with another"""
+    key = COLLECTION_KEYS[collection]
+    problems = []
+    positions = {}
+    for pos, record in enumerate(records):
+        if record.get(key) in (None, ""):
+            problems.append(f"record #{pos + 1} has no {key}")
+        else:
+            positions.setdefault(_record_pk(collection, record), []).append(pos + 1)
+    problems += [f"{key} {pk} is used by records #{', #'.join(map(str, found))}"
+                 for pk, found in positions.items() if len(found) > 1]
+    if problems:
+        raise RecordKeyError(collection, problems)
+
+
+def _repair_legacy_keys(collection: str, records: List[Dict[str, Any]]) -> List[str]:
+    """Give legacy records with a missing or repeated ID a new one, in place.
+
+    The first record keeps a repeated ID. New IDs come from the collection's
+    ID sequence where it has one, otherwise the old ID gets a numeric suffix;
+    the old ID is kept in ``legacy_<key>``. Returns a line per record changed.
+    """
+    key = COLLECTION_KEYS[collection]
+    prefix = next((prefix for prefix, (owner, field, _) in ID_SEQUENCES.items() if (owner, field) == (collection, key)),
+                  None)
+    used = {_record_pk(collection, record) for record in records if record.get(key) not in (None, "")}
+    last = 0
+    if prefix:
+        for pk in used:
+            try:
+                last = max(last, int(pk.replace(prefix, "")))
+            except ValueError:
+                continue
+
+    seen, repairs = set(), []
+    for pos, record in enumerate(records):
+        old = record.get(key)
+        if old not in (None, "") and _record_pk(collection, record) not in seen:
+            seen.add(_record_pk(collection, record))
+            continue
+        suffix = 0
+        while True:
+            if prefix:
+                last += 1
+                new = f"{prefix}{str(last).zfill(ID_SEQUENCES[prefix][2])}"
+            else:
+                suffix += 1
+                new = f"{old if old not in (None, '') else 'LEGACY'}-{suffix}"
+            if new not in used:
+                break
+        used.add(new)
+        seen.add(new)
+        records[pos] = dict(record, **{key: new, f"legacy_{key}": old})
+        problem = f"had no {key}" if old in (None, "") else f"repeated {key} {old}"
+        repairs.append(f"{collection} record #{pos + 1} {problem} - now {new}")
+    return repairs
+
+
+def _import_legacy(conn: sqlite3.Connection, legacy: Dict[str, Any]):
+    """Copy the legacy JSON file into a new database, re-keying records whose IDs clash.
+
+    The changes are kept under ``legacy_import_repairs`` for an admin to review.
+    """
+    repairs = []
+    for collection in COLLECTION_KEYS:
+        value = legacy.get(collection)
+        if value is None or collection == "users":
+            continue
+        records = list(value.values()) if isinstance(value, dict) else list(value)
+        repairs += _repair_legacy_keys(collection, records)
+        legacy[collection] = records
+    if repairs:
+        legacy["legacy_import_repairs"] = repairs
+    _sync_snapshot(conn, legacy)
+
+
+def _sync_collection(conn: sqlite3.Connection, collection: str, records: List[Dict[str, Any]]):
+    """Make a collection table match ``records``, writing only rows that differ.
+
+    Every record must carry a unique ID - rows are keyed on it, so a missing
+    or repeated one would merge records silently.
+    """
+    _check_record_keys(collection, records)
+    stored = dict(conn.execute(f"SELECT pk, data FROM {collection}"))
+    seen = set()
+    for record in records:
+        pk = _record_pk(collection, record)
+        seen.add(pk)
+        encoded = _encode(record)
+        if stored.get(pk) != encoded:
+            conn.execute(
+                f"INSERT INTO {collection} (pk, data) VALUES (?, ?) "
+                f"ON CONFLICT(pk) DO UPDATE SET data = excluded.data, version = {collection}.version + 1",
+                (pk, encoded)
+            )
+            _journal(conn, collection, pk, "insert" if pk not in stored else "update")
+    for pk in stored.keys() - seen:
+        conn.execute(f"DELETE FROM {collection} WHERE pk = ?", (pk,))
+        _journal(conn, collection, pk, "delete")
+
+
+def _sync_snapshot(conn: sqlite3.Connection, data: Dict[str, Any]):
+    """Write a full in-memory snapshot, touching only changed rows"""
+    for collection in COLLECTION_KEYS:
+        value = data.get(collection)
+        if value is None:
+            continue
+        if collection == "users":
+            records = [dict(record, username=name) for name, record in value.items()]
+        else:
+            records = list(value.values()) if isinstance(value, dict) else value
+        _sync_collection(conn, collection, records)
+
+    stored = dict(conn.execute("SELECT key, value FROM kv_store"))
+    for key, value in data.items():
+        if key in COLLECTION_KEYS or key.startswith("_"):
+            continue
+        encoded = _encode(value)
+        if stored.get(key) != encoded:
+            conn.execute(
+                "INSERT INTO kv_store (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (key, encoded)
+            )
+            _journal(conn, "kv_store", key, "update")
+
+
+def get_record(collection: str, pk: str) -> Optional[Dict[str, Any]]:
+    """Fetch a single record by its ID, or None if it does not exist"""
+    row = get_connection().execute(f"SELECT data FROM {collection} WHERE pk = ?", (str(pk),)).fetchone()
+    return json.loads(row[0]) if row else None
+
+
+def insert_record(collection: str, record: Dict[str, Any]) -> bool:
+    """Insert one record into a collection table"""
+    try:
+        conn = get_connection()
+        head_before = journal_head()
+        with write_transaction(conn):
+            pk = _record_pk(collection, record)
+            conn.execute(f"INSERT INTO {collection} (pk, data) VALUES (?, ?)", (pk, _encode(record)))
+            _journal(conn, collection, pk, "insert")
+        _after_write(conn, head_before)
+        return True
+    except sqlite3.Error as e:
+        st.error(f"Error saving data: {e}")
+        return False
+
+
+def record_version(data: Dict[str, Any], collection: str, pk: str) -> Optional[int]:
+    """Version of a record as of the snapshot returned by load_data()"""
+    return data.get("_versions", {}).get(collection, {}).get(str(pk))
+
+
+def seen_version(data: Dict[str, Any], collection: str, pk: str, key: str) -> Optional[int]:
+    """Version of a record as the user saw it in the form ``key`` - call while drawing the form.
+
+    A submit reruns the script and reloads ``data``, so the version to check
+    against is the one remembered when the form was drawn on the previous run;
+    the current one is remembered for the next submit.
+    """
+    state_key = f"seen_version_{key}"
+    current = record_version(data, collection, pk)
+    seen = st.session_state.get(state_key, current)
+    st.session_state[state_key] = current
+    return seen
+
+
+def update_records(updates: List[tuple]) -> bool:
+    """Apply updates atomically, rewriting only those rows.
+
+    Each update is (collection, pk, changes) or
+    (collection, pk, changes, expected_version). If a row is gone, or an
+    expected version is given and the row has moved on, nothing is written
+    and WriteConflictError is raised for the caller to report.
+    """
+    try:
+        conn = get_connection()
+        head_before = journal_head()
+        with write_transaction(conn):
+            for collection, pk, changes, *expected in updates:
+                expected_version = expected[0] if expected else None
+                row = conn.execute(f"SELECT data, version FROM {collection} WHERE pk = ?", (str(pk),)).fetchone()
+                if row is None or (expected_version is not None and row[1] != expected_version):
+                    raise WriteConflictError(collection, pk)
+                record = json.loads(row[0])
+                record.update(changes)
+                conn.execute(f"UPDATE {collection} SET data = ?, version = version + 1 WHERE pk = ?",
+                             (_encode(record), str(pk)))
+                _journal(conn, collection, pk, "update")
+        _after_write(conn, head_before)
+        return True
+    except sqlite3.Error as e:
+        st.error(f"Error saving data: {e}")
+        return False
+
+
+def update_record(collection: str, pk: str, changes: Dict[str, Any],
+                  expected_version: Optional[int] = None) -> bool:
+    """Update fields of a single record, optionally only if it is still at ``expected_version``"""
+    return update_records([(collection, pk, changes, expected_version)])
+
+
+def update_records_checked(updates: List[tuple]) -> bool:
+    """Apply (collection, pk, changes, seen_version) updates only if none changed since the user saw them.
+
+    A record with no known version (it was not in the user's snapshot) counts
+    as changed. A conflict is reported to the user as a warning and nothing
+    is written.
+    """
+    try:
+        for collection, pk, _, version in updates:
+            if version is None:
+                raise WriteConflictError(collection, pk)
+        return update_records(updates)
+    except WriteConflictError as e:
+        st.warning(f"⚠️ {e}")
+        return False
+
+
+def update_record_checked(collection: str, pk: str, changes: Dict[str, Any], version: Optional[int]) -> bool:
+    """Single-record form of update_records_checked"""
+    return update_records_checked([(collection, pk, changes, version)])
+
+
+def delete_records(deletes: List[tuple]) -> Optional[int]:
+    """Delete (collection, pk) records atomically.
+
+    Returns how many were deleted - records someone else already removed are
+    not counted - or None if the write failed.
+    """
+    try:
+        conn = get_connection()
+        head_before = journal_head()
+        deleted = 0
+        with write_transaction(conn):
+            for collection, pk in deletes:
+                if conn.execute(f"DELETE FROM {collection} WHERE pk = ?", (str(pk),)).rowcount:
+                    _journal(conn, collection, pk, "delete")
+                    deleted += 1
+        _after_write(conn, head_before)
+        return deleted
+    except sqlite3.Error as e:
+        st.error(f"Error saving data: {e}")
+        return None
+
+
+def delete_record(collection: str, pk: str) -> bool:
+    """Delete a single record by its ID"""
+    return delete_records([(collection, pk)]) is not None
+
+
+def set_value(key: str, value: Any) -> bool:
+    """Store a top-level value such as the dashboard settings"""
+    try:
+        conn = get_connection()
+        head_before = journal_head()
+        with write_transaction(conn):
+            conn.execute(
+                "INSERT INTO kv_store (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (key, _encode(value))
+            )
+            _journal(conn, "kv_store", key, "update")
+        _after_write(conn, head_before)
+        return True
+    except sqlite3.Error as e:
+        st.error(f"Error saving data: {e}")
+        return False
+
+
+# ====================
+# WORKFLOWS - declarative status transitions with an audit trail
+# ====================
+# Each workflow names the field holding a record's state and a table of
+# transitions keyed by (action, role), so finding the transition a user may
+# apply is one dict lookup and a missing key is the role guard. A transition
+# moves records whose state is still one of its sources - records that moved
+# on in the meantime are skipped - stamps the actor and time if asked to, and
+# runs its follow-on transitions on linked records (those sharing the link
+# field, found by primary key when the link is the other collection's ID).
+# Everything happens in one write transaction and each change appends a row
+# to audit_log, which triggers keep append-only.
+FOLLOW_ON = "*"  # role key of transitions only reachable as follow-ons
+
+
+class Transition(NamedTuple):
+    """One step of a workflow - ``sources`` None means from any state"""
+    sources: Optional[tuple]
+    target: Any
+    stamp: tuple = ()  # (actor field, time field)
+    follow: tuple = ()  # ((collection, link field, action), ...)
+
+
+class Workflow(NamedTuple):
+    field: str
+    transitions: Dict[tuple, Transition]
+
+
+WORKFLOWS = {
+    "insurance_entries": Workflow("status", {
+        ("approve", "branch_manager"): Transition(("submitted",), "approved_by_branch_manager",
+                                                  stamp=("approved_by_bm", "bm_approval_time")),
+        ("approve", "area_manager"): Transition(("approved_by_branch_manager",), "approved_by_area_manager",
+                                                stamp=("approved_by_am", "am_approval_time")),
+        ("approve", "AGM"): Transition(("approved_by_area_manager",), "approved_by_agm",
+                                       stamp=("approved_by_agm", "agm_approval_time")),
+        ("reject", "branch_manager"): Transition(("submitted",), "rejected"),
+        ("reject", "area_manager"): Transition(("approved_by_branch_manager",), "rejected"),
+        ("reject", "AGM"): Transition(("approved_by_area_manager",), "rejected"),
+    }),
+    "leads": Workflow("status", {
+        ("approve", "branch_manager"): Transition(("submitted",), "approved_by_branch_manager"),
+        ("approve", "area_manager"): Transition(("approved_by_branch_manager",), "approved_by_area_manager"),
+        ("approve", "AGM"): Transition(("approved_by_area_manager",), "approved_by_agm"),
+    }),
+    "bids": Workflow("status", {
+        **{("approve", role): Transition(("PLACED",), "APPROVED", follow=(("credits_fin_entries", "entry_id", "book"),))
+           for role in ("admin", "AGM")},
+        **{("reject", role): Transition(("PLACED",), "REJECTED") for role in ("admin", "AGM")},
+        ("book", FOLLOW_ON): Transition(None, "BOOKED"),
+        ("reopen", FOLLOW_ON): Transition(None, "PLACED"),
+    }),
+    "credits_fin_entries": Workflow("booked", {
+        ("book", FOLLOW_ON): Transition((False, None), True),
+        ("book", "AGM"): Transition((False, None), True, follow=(("bids", "entry_id", "book"),)),
+        ("unbook", "AGM"): Transition((True,), False, follow=(("bids", "entry_id", "reopen"),)),
+    }),
+}
+
+
+def transition_for(collection: str, action: str, role: str) -> Optional[Transition]:
+    """The transition ``role`` may apply for ``action``, or None if it is not allowed to"""
+    return WORKFLOWS[collection].transitions.get((action, role))
+
+
+def can_transition(collection: str, action: str, role: str, record: Dict[str, Any]) -> bool:
+    """Whether ``role`` may apply ``action`` to ``record`` in its current state"""
+    transition = transition_for(collection, action, role)
+    return transition is not None and (
+        transition.sources is None or record.get(WORKFLOWS[collection].field) in transition.sources)
+
+
+def _apply_transition(conn: sqlite3.Connection, actor: Dict, collection: str, pk: str, action: str,
+                      transition: Transition, changes: Dict[str, Any], at: str) -> bool:
+    field = WORKFLOWS[collection].field
+    row = conn.execute(f"SELECT data FROM {collection} WHERE pk = ?", (str(pk),)).fetchone()
+    record = json.loads(row[0]) if row else None
+    if record is None or (transition.sources is not None and record.get(field) not in transition.sources):
+        return False
+
+    source = record.get(field)
+    record[field] = transition.target
+    if transition.stamp:
+        actor_field, time_field = transition.stamp
+        record[actor_field] = actor.get("username")
+        record[time_field] = at
+    record.update(changes)
+    conn.execute(f"UPDATE {collection} SET data = ?, version = version + 1 WHERE pk = ?", (_encode(record), str(pk)))
+    _journal(conn, collection, pk, "update")
+    conn.execute(
+        "INSERT INTO audit_log (at, actor, role, collection, pk, action, source, target) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (at, actor.get("username"), actor.get("role"), collection, str(pk), action,
+         _encode(source), _encode(transition.target))
+    )
+
+    for linked, link, follow_action in transition.follow:
+        if link == COLLECTION_KEYS[linked]:
+            linked_pks = [record.get(link)]
+        else:
+            linked_pks = [pk for (pk,) in conn.execute(
+                f"SELECT pk FROM {linked} WHERE json_extract(data, ?) = ?", (f"$.{link}", record.get(link)))]
+        follow = WORKFLOWS[linked].transitions[(follow_action, FOLLOW_ON)]
+        for linked_pk in linked_pks:
+            _apply_transition(conn, actor, linked, linked_pk, follow_action, follow, {}, at)
+    return True
+
+
+def apply_transition(user: Dict, collection: str, action: str, pks: List[str],
+                     changes: Optional[Dict[str, Any]] = None) -> Optional[int]:
+    """Apply ``action`` as ``user`` to the records ``pks`` in one transaction.
+
+    ``changes`` are extra fields written with the transition (a rejection
+    reason, say). Returns how many records moved - the rest had left the
+    transition's source states - or None if the role may not do this or the
+    write failed.
+    """
+    transition = transition_for(collection, action, user.get("role"))
+    if transition is None:
+        st.error(f"❌ Access Denied: {user.get('role')} cannot {action} these records")
+        return None
+    try:
+        conn = get_connection()
+        head_before = journal_head()
+        at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with write_transaction(conn):
+            applied = sum(_apply_transition(conn, user, collection, pk, action, transition, changes or {}, at)
+                          for pk in pks)
+        _after_write(conn, head_before)
+        return applied
+    except sqlite3.Error as e:
+        st.error(f"Error saving data: {e}")
+        return None
+
+
+def apply_transition_one(user: Dict, collection: str, action: str, pk: str,
+                         changes: Optional[Dict[str, Any]] = None) -> bool:
+    """Single-record form of apply_transition that warns when the record had already moved on"""
+    applied = apply_transition(user, collection, action, [pk], changes)
+    if applied == 0:
+        st.warning(f"⚠️ {pk} was changed by someone else in the meantime. Please review it again.")
+    return bool(applied)
+
+
+# ====================
+# DATA FUNCTIONS - process-wide snapshot cache validated by file stat
+# ====================
+# All sessions share one parsed snapshot. It is reused as long as the
+# database file and its WAL keep the same (mtime, size, inode). When they
+# change - a write from this or another process - the journal entries since
+# the snapshot was read are applied to a copy of it, re-reading only the
+# written rows; a full read happens only if the journal was compacted past
+# that point or too much changed. Pages must treat the snapshot as read-only
+# and go through the record-level write helpers above.
+SNAPSHOT_REFRESH_LIMIT = 500
+
+
+@st.cache_resource
+def _shared_load_cache():
+    """Cache state that outlives reruns - Streamlit executes this script in a fresh module each time"""
+    return {"signature": None, "data": None}, threading.Lock(), {"hits": 0, "refreshes": 0, "misses": 0}
+
+
+_load_cache, _load_cache_lock, LOAD_CACHE_STATS = _shared_load_cache()
+
+
+def _data_file_signature() -> tuple:
+    """(mtime, size, inode) of the database file and its WAL"""
+    signature = []
+    for path in (DB_FILE, DB_FILE + "-wal"):
+        try:
+            stat = os.stat(path)
+            signature.append((stat.st_mtime_ns, stat.st_size, stat.st_ino))
+        except FileNotFoundError:
+            signature.append(None)
+    return tuple(signature)
+
+
+def invalidate_load_cache():
+    """Force the next load_data() call to re-read the database"""
+    with _load_cache_lock:
+        _load_cache["signature"] = None
+
+
+def load_cache_stats() -> Dict[str, int]:
+    """Snapshot of the load_data cache hit/miss counters"""
+    with _load_cache_lock:
+        return dict(LOAD_CACHE_STATS)
+
+
+def load_data() -> Dict[str, Any]:
+    """Return the shared data snapshot, re-reading the database only when it changed"""
+    signature = _data_file_signature()
+    with _load_cache_lock:
+        cached = _load_cache["data"]
+        if cached is not None and _load_cache["signature"] == signature:
+            LOAD_CACHE_STATS["hits"] += 1
+            return dict(cached)
+
+    # Stat is taken before reading, so the cached data is never older than its signature
+    data = _refresh_snapshot(cached) if cached is not None else None
+    refreshed = data is not None
+    if not refreshed:
+        data = _read_snapshot()
+    with _load_cache_lock:
+        LOAD_CACHE_STATS["refreshes" if refreshed else "misses"] += 1
+        _load_cache["signature"] = signature
+        _load_cache["data"] = data
+    return dict(data)
+
+
+def _normalize(collection: str, record: Dict[str, Any]) -> Dict[str, Any]:
+    """Fill in fields older records may lack"""
+    # Ensure submitted_by field exists
+    if collection == "leads" and "submitted_by" not in record:
+        record["submitted_by"] = record.get("staff_name") or "unknown"
+    return record
+
+
+def _refresh_snapshot(old: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Apply journal entries written since ``old`` was read to a copy of it.
+
+    Returns None when a full read is needed instead.
+    """
+    try:
+        conn = get_connection()
+        conn.execute("BEGIN")
+        try:
+            changes = changes_since(old["_head"])
+            if changes is None or len(changes) > SNAPSHOT_REFRESH_LIMIT:
+                return None
+            head = journal_head()
+            written, reinserted = {}, set()
+            for _, collection, pk, op in changes:
+                written.setdefault(collection, set()).add(pk)
+                if op == "delete":
+                    reinserted.add((collection, pk))
+            rows = {}
+            for collection, pks in written.items():
+                marks = ", ".join("?" * len(pks))
+                if collection == "kv_store":
+                    rows[collection] = dict(conn.execute(
+                        f"SELECT key, value FROM kv_store WHERE key IN ({marks})", tuple(pks)))
+                else:
+                    rows[collection] = {pk: (json.loads(raw), version) for pk, raw, version in conn.execute(
+                        f"SELECT pk, data, version FROM {collection} WHERE pk IN ({marks}) ORDER BY id", tuple(pks))}
+        finally:
+            conn.execute("COMMIT")
+    except (sqlite3.Error, ValueError):
+        return None
 
-        # Ensure all keys exist
-        data.setdefault("users", {})
-        data.setdefault("customers", {})
+    data = dict(old)
+    data["_head"] = head
+    data["_versions"] = dict(old["_versions"])
+    data["_index"] = {key: value for key, value in old["_index"].items()
+                      if not (isinstance(key, tuple) and key[1] in written)}
+    if "users" in written:
+        data["_index"].pop("agm_branches", None)
+
+    for collection, pks in written.items():
+        current = rows[collection]
+        if collection == "kv_store":
+            for key in pks:
+                if key.startswith("_"):
+                    continue
+                if key in current:
+                    data[key] = json.loads(current[key])
+                else:
+                    data.pop(key, None)
+            continue
 
-        # Convert leads dict to list if needed
-        leads_val = data.get("leads", [])
-        data["leads"] = list(leads_val.values()) if isinstance(leads_val, dict) else leads_val or []
+        versions = dict(old["_versions"].get(collection, {}))
+        for pk in pks:
+            if pk in current:
+                versions[pk] = current[pk][1]
+            else:
+                versions.pop(pk, None)
+        data["_versions"][collection] = versions
+
+        if collection == "users":
+            users = {pk: current[pk][0] if pk in pks else record
+                     for pk, record in old["users"].items() if pk not in pks or pk in current}
+            users.update((pk, record) for pk, (record, _) in current.items() if pk not in users)
+            data["users"] = users
+            continue
 
-        data.setdefault("customer_leads", [])
-        data.setdefault("insurance_entries", [])
-        data.setdefault("reliant_best_entries", [])
-        data.setdefault("credits_fin_entries", [])
-        data.setdefault("bids", [])
-        data.setdefault("dashboard", default["dashboard"])
+        # Rows keep their place unless they are new (or were deleted and re-created),
+        # which always gives them a higher id than every other row
+        old_positions = record_positions(old, collection)
+        moved = [pk for pk in current if pk not in old_positions or (collection, pk) in reinserted]
+        moved_set = set(moved)
+        records = []
+        for record in old.get(collection, []):
+            pk = _record_pk(collection, record)
+            if pk not in pks:
+                records.append(record)
+            elif pk in current and pk not in moved_set:
+                records.append(_normalize(collection, current[pk][0]))
+        records.extend(_normalize(collection, current[pk][0]) for pk in moved)
+        data[collection] = records
+        _patch_index(old, data, collection, {pk: current[pk][0] if pk in current else None for pk in pks})
+
+    data.setdefault("customers", {})
+    data.setdefault("dashboard", dict(_DEFAULT_DASHBOARD))
+    return data
+
+
+_DEFAULT_DASHBOARD = {
+    "text": "Welcome to Reliant Central. Please login to continue.",
+    "image_path": None
+}
 
-        # Ensure submitted_by field exists
-        for lead in data["leads"]:
-            if "submitted_by" not in lead:
-                lead["submitted_by"] = lead.get("staff_name") or "unknown"
 
-        return data
+def _read_snapshot() -> Dict[str, Any]:
+    """Load all collections from the SQLite store with proper initialization"""
+    try:
+        conn = get_connection()
+        # One read transaction so every table (and every version) comes from the same commit
+        conn.execute("BEGIN")
+        try:
+            data = {key: json.loads(value) for key, value in conn.execute("SELECT key, value FROM kv_store")
+                    if not key.startswith("_")}
+            data["_head"] = journal_head()
+            data["_versions"] = {}
+            data["_index"] = {}
+            for collection in COLLECTION_KEYS:
+                rows = conn.execute(f"SELECT pk, data, version FROM {collection} ORDER BY id").fetchall()
+                data["_versions"][collection] = {pk: version for pk, _, version in rows}
+                if collection == "users":
+                    data["users"] = {pk: json.loads(raw) for pk, raw, _ in rows}
+                else:
+                    data[collection] = [_normalize(collection, json.loads(raw)) for _, raw, _ in rows]
+        finally:
+            conn.execute("COMMIT")
+    except (sqlite3.Error, ValueError, RecordKeyError) as e:
+        # Never hand pages an empty database: a later save would wipe real data
+        st.error(f"Error loading data: {e}")
+        st.stop()
 
-    return default
+    data.setdefault("customers", {})
+    data.setdefault("dashboard", dict(_DEFAULT_DASHBOARD))
+    return data
 
 
 def save_data(data: Dict[str, Any]) -> bool:
-    """Save data to JSON file"""
+    """Save a full data snapshot - only rows that changed are written"""
     try:
-        with open(DATA_FILE, "w") as f:
-            json.dump(data, f, indent=2)
+        conn = get_connection()
+        head_before = journal_head()
+        with write_transaction(conn):
+            _sync_snapshot(conn, data)
+        _after_write(conn, head_before)
         return True
-    except Exception as e:
+    except (sqlite3.Error, RecordKeyError) as e:
         st.error(f"Error saving data: {e}")
         return False
 
 
+def atomic_write(path: str, content: bytes):
+    """Write a file via temp file + rename so readers never see a partial file"""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
 def hash_password(pw: str) -> str:
     """Hash password using bcrypt"""
     return bcrypt.hashpw(pw.encode(), bcrypt.gensalt()).decode()
@@ -154,43 +1011,19 @@ def generate_customer_id(leads_list: List[Dict[str, Any]]) -> str:
     return str(last_id + 1).zfill(3)
 
 
-def generate_lead_id(leads_list: List[Dict[str, Any]]) -> str:
+def generate_lead_id() -> str:
     """Generate unique lead ID for customer leads"""
-    last_id = 0
-    for lead in leads_list:
-        try:
-            lid = int(str(lead.get("lead_id", "")).replace("LEAD-", ""))
-            if lid > last_id:
-                last_id = lid
-        except ValueError:
-            continue
-    return f"LEAD-{str(last_id + 1).zfill(4)}"
+    return next_id("LEAD-")
 
 
-def generate_insurance_entry_id(entries: List[Dict[str, Any]]) -> str:
+def generate_insurance_entry_id() -> str:
     """Generate unique insurance entry ID"""
-    last_id = 0
-    for entry in entries:
-        try:
-            eid = int(str(entry.get("entry_id", "")).replace("INS-", ""))
-            if eid > last_id:
-                last_id = eid
-        except ValueError:
-            continue
-    return f"INS-{str(last_id + 1).zfill(4)}"
+    return next_id("INS-")
 
 
-def generate_insurance_customer_id(entries: List[Dict[str, Any]]) -> str:
+def generate_insurance_customer_id() -> str:
     """Generate unique insurance customer ID"""
-    last_id = 0
-    for entry in entries:
-        try:
-            cid = int(str(entry.get("customer_id", "")).replace("INSC-", ""))
-            if cid > last_id:
-                last_id = cid
-        except ValueError:
-            continue
-    return f"INSC-{str(last_id + 1).zfill(5)}"
+    return next_id("INSC-")
 # ===========================
 # STEP 1: ADD RELIANT BEST ID GENERATORS
 # ===========================
@@ -208,18 +1041,9 @@ def generate_reliant_best_customer_id(entries: List[Dict[str, Any]]) -> str:
             continue
     return f"RB-{str(last_id + 1).zfill(5)}"
 
-def generate_reliant_best_entry_id(entries: List[Dict[str, Any]]) -> str:
-    if not entries:  # Check if the list is empty
-        return "RBE-000001"  # Start with a default if no entries exist
-    last_id = 0
-    for entry in entries:
-        try:
-            eid = int(str(entry.get("entry_id", "")).replace("RBE-", ""))
-            if eid > last_id:
-                last_id = eid
-        except ValueError:
-            continue
-    return f"RBE-{str(last_id + 1).zfill(6)}"
+def generate_reliant_best_entry_id() -> str:
+    """Generate unique RELIANT BEST entry ID - Format: RBE-000001"""
+    return next_id("RBE-")
 def generate_gl_customer_id(entries: List[Dict[str, Any]]) -> str:
     """Generate unique GOLD (GL) customer ID - Format: GL-00001"""
     last_id = 0
@@ -243,215 +1067,1158 @@ def generate_pl_customer_id(entries: List[Dict[str, Any]]) -> str:
             continue
     return f"PL-{str(last_id + 1).zfill(5)}"
 
-def generate_credits_fin_entry_id(entries: List[Dict[str, Any]]) -> str:
-    """Generate unique Credits FIN entry ID - Format: CF-00001"""
-    last_id = 0
-    for entry in entries:
-        try:
-            cid = int(str(entry.get("entry_id", "")).replace("CF-", ""))
-            if cid > last_id:
-                last_id = cid
-        except ValueError:
-            continue
-    return f"CF-{str(last_id + 1).zfill(5)}"
+def generate_credits_fin_entry_id() -> str:
+    """Generate unique Credits FIN entry ID - Format: CF-00001"""
+    return next_id("CF-")
+
+def generate_bid_id() -> str:
+    """Generate unique Bid ID - Format: BID-00001"""
+    return next_id("BID-")
+
+
+# ====================
+# EXPORTS - rows streamed into a write-only workbook or CSV
+# ====================
+# An export is a list of (header, getter) columns applied to one record at a
+# time, so no intermediate row dicts or DataFrame are built, and openpyxl's
+# write-only mode keeps memory flat however many rows a report has.
+EXCEL_CELL_LIMIT = 32767
+EXPORT_PROGRESS_EVERY = 2000
+_HEADER_SIDE = Side(style="thin")
+
+
+def _cell_value(value):
+    """Convert a record value the way pandas' Excel writer did - blank when missing, str() when not a scalar"""
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    if isinstance(value, (bool, int, float, datetime, date)):
+        return value
+    return str(value)[:EXCEL_CELL_LIMIT]
+
+
+def record_columns(fields: List[str], order: Optional[List[str]] = None) -> List[tuple]:
+    """Columns for a raw record dump - every field given, or the fields of `order` that are among them"""
+    keys = [key for key in order if key in fields] if order else list(fields)
+    return [(key, lambda record, key=key: record.get(key)) for key in keys]
+
+
+def iter_export_rows(columns: List[tuple], records, progress=None):
+    """Converted rows; progress(rows_done) is called every EXPORT_PROGRESS_EVERY rows"""
+    for done, record in enumerate(records, 1):
+        yield [_cell_value(getter(record)) for _, getter in columns]
+        if progress is not None and done % EXPORT_PROGRESS_EVERY == 0:
+            progress(done)
+
+
+def write_workbook(sheets: List[tuple], output=None, progress=None):
+    """Stream (sheet name, columns, records) sheets into one write-only workbook, in memory unless a binary file is given
+
+    progress(rows_done) counts rows across all sheets.
+    """
+    workbook = Workbook(write_only=True)
+    written = 0
+    for sheet_name, columns, records in sheets:
+        sheet = workbook.create_sheet(sheet_name)
+        header = []
+        for title, _ in columns:
+            cell = WriteOnlyCell(sheet, value=title)
+            cell.font = Font(bold=True)
+            cell.border = Border(left=_HEADER_SIDE, right=_HEADER_SIDE, top=_HEADER_SIDE, bottom=_HEADER_SIDE)
+            cell.alignment = Alignment(horizontal="center", vertical="top")
+            header.append(cell)
+        sheet.append(header)
+        sheet_progress = (lambda done, offset=written: progress(offset + done)) if progress else None
+        for row in iter_export_rows(columns, records, sheet_progress):
+            sheet.append(row)
+            written += 1
+
+    output = output or BytesIO()
+    workbook.save(output)
+    output.seek(0)
+    return output
+
+
+def write_xlsx(columns: List[tuple], records, sheet_name: str, output=None, progress=None):
+    """Stream records into a single-sheet write-only workbook, in memory unless a binary file is given"""
+    return write_workbook([(sheet_name, columns, records)], output, progress)
+
+
+def write_csv(columns: List[tuple], records, output=None, progress=None):
+    """Stream records as UTF-8 CSV with a BOM so Excel detects the encoding, in memory unless a binary file is given"""
+    output = output or BytesIO()
+    text = io.TextIOWrapper(output, encoding="utf-8-sig", newline="")
+    writer = csv.writer(text)
+    writer.writerow([title for title, _ in columns])
+    writer.writerows(iter_export_rows(columns, records, progress))
+    text.flush()
+    text.detach()
+    output.seek(0)
+    return output
+
+
+INSURANCE_EXPORT_COLUMNS = [
+    ("Entry ID", lambda e: e.get("entry_id")),
+    ("Customer ID", lambda e: e.get("customer_id")),
+    ("Date", lambda e: e.get("timestamp", "").split(" ")[0]),
+    ("Staff ID", lambda e: e.get("staff_id")),
+    ("Staff Name", lambda e: e.get("staff_name")),
+    ("Branch", lambda e: e.get("branch")),
+    ("Applicant Name", lambda e: e.get("applicant_name")),
+    ("Age", lambda e: e.get("age")),
+    ("Address", lambda e: e.get("address")),
+    ("Phone", lambda e: e.get("phone_number")),
+    ("Aadhar", lambda e: e.get("aadhar_number")),
+    ("Insurance Type", lambda e: e.get("insurance_type")),
+    ("Premium", lambda e: e.get("premium")),
+    ("Status", lambda e: e.get("status")),
+    ("BM Approved By", lambda e: e.get("approved_by_bm") or "Pending"),
+    ("BM Approval Time", lambda e: e.get("bm_approval_time") or "N/A"),
+    ("AM Approved By", lambda e: e.get("approved_by_am") or "Pending"),
+    ("AM Approval Time", lambda e: e.get("am_approval_time") or "N/A"),
+    ("AGM Approved By", lambda e: e.get("approved_by_agm") or "Pending"),
+    ("AGM Approval Time", lambda e: e.get("agm_approval_time") or "N/A"),
+    ("Rejection Reason", lambda e: e.get("rejection_reason") or "N/A"),
+]
+
+# GOLD and PL in ONE row
+RELIANT_BEST_EXPORT_COLUMNS = [
+    ("Entry ID", lambda e: e.get("entry_id")),
+    ("Customer ID(GL)", lambda e: e.get("customer_id_gl", "")),
+    ("Date", lambda e: e.get("timestamp", "").split(" ")[0]),
+    ("Staff ID", lambda e: e.get("staff_id")),
+    ("Staff Name", lambda e: e.get("staff_name")),
+    ("Branch", lambda e: e.get("branch")),
+    # GOLD Section
+    ("Section", lambda e: "GOLD & PL"),
+    ("GL Loan Number", lambda e: e.get("gold_loan_number", "")),
+    ("GL Name", lambda e: e.get("gold_name", "")),
+    ("Gross Weight (grams)", lambda e: e.get("gold_gross_weight", "")),
+    ("Net Weight (grams)", lambda e: e.get("gold_net_weight", "")),
+    ("Gold Amount", lambda e: e.get("gold_amount", "")),
+    # PL Section
+    ("Customer ID(PL)", lambda e: e.get("customer_id_pl", "")),
+    ("PL Loan Number", lambda e: e.get("pl_loan_number", "")),
+    ("PL Name", lambda e: e.get("pl_name", "")),
+    ("PL Amount", lambda e: e.get("pl_amount", "")),
+]
+
+
+def export_to_excel(leads: List[Dict], fields: List[str], filename: str = "crm_data.xlsx") -> BytesIO:
+    """Export leads to Excel"""
+    return write_xlsx(record_columns(fields), leads, "Leads")
+
+
+def export_to_csv(leads: List[Dict], fields: List[str]) -> BytesIO:
+    """Export leads to CSV"""
+    return write_csv(record_columns(fields), leads)
+
+
+def export_insurance_to_excel(entries: List[Dict], fields: List[str], filename: str = "insurance_data.xlsx") -> BytesIO:
+    """Export insurance entries to Excel without image data"""
+    return write_xlsx(INSURANCE_EXPORT_COLUMNS, entries, "Insurance")
+
+
+def export_insurance_to_csv(entries: List[Dict], fields: List[str]) -> BytesIO:
+    """Export insurance entries to CSV without image data"""
+    return write_csv(INSURANCE_EXPORT_COLUMNS, entries)
+
+
+def export_reliant_best_to_excel(entries: List[Dict], fields: List[str]) -> BytesIO:
+    """Export RELIANT BEST entries to Excel with GOLD and PL in ONE row"""
+    return write_xlsx(RELIANT_BEST_EXPORT_COLUMNS, entries, "Reliant Best")
+
+def get_image_base64(image_path: str) -> str:
+    """Convert image to base64 for display"""
+    try:
+        with open(image_path, "rb") as img_file:
+            return base64.b64encode(img_file.read()).decode()
+    except:
+        return ""
+
+# ====================
+# ROLE SCOPES & RECORD INDEXES
+# ====================
+# Snapshots from load_data() are shared read-only, so anything derived from
+# one is memoized in its "_index" dict: every AGM's branch set (resolved in a
+# single pass over the user hierarchy), each record's position, the primary
+# keys of records grouped by a field such as branch, staff or status, the
+# field names a collection's records use (the columns of a raw export), and a
+# timeline of (parsed timestamp, primary key) in sorted order for date ranges.
+# Filtering intersects those key sets and only touches matching records.
+# Report figures come from materialized aggregates: record counts (and amount
+# totals) per (branch, staff, day, ...) cell, read as a typed DataFrame and
+# masked to a role's scope.
+# load_data() carries the indexes over to the next snapshot, patching just the
+# records that were written; the AGM branch sets are rebuilt when users change.
+class RoleScope(NamedTuple):
+    """Branches a user can see - None means every branch (admin)"""
+    role: str
+    username: str
+    branches: Optional[frozenset]
+
+
+def _snapshot_index(db: Dict) -> Dict:
+    if "_index" not in db:
+        db["_index"] = {}
+    return db["_index"]
+
+
+def role_scope(db: Dict, user: Dict) -> RoleScope:
+    """Resolve the branches visible to ``user``"""
+    role = user.get("role")
+    username = user.get("username")
+
+    if role == "admin":
+        return RoleScope(role, username, None)
+    if role == "AGM":
+        index = _snapshot_index(db)
+        if "agm_branches" not in index:
+            agm_branches = {}
+            for d in db["users"].values():
+                if d.get("role") == "area_manager":
+                    agm_branches.setdefault(d.get("created_by"), set()).update(d.get("assigned_branches", []))
+            index["agm_branches"] = {agm: frozenset(b) for agm, b in agm_branches.items()}
+        return RoleScope(role, username, index["agm_branches"].get(username, frozenset()))
+    return RoleScope(role, username, frozenset(user.get("assigned_branches", [])))
+
+
+def record_positions(db: Dict, collection: str) -> Dict[str, int]:
+    """Position of each record in ``db[collection]`` by primary key"""
+    index = _snapshot_index(db)
+    key = ("positions", collection)
+    if key not in index:
+        index[key] = {_record_pk(collection, r): pos for pos, r in enumerate(db.get(collection, []))}
+    return index[key]
+
+
+def record_groups(db: Dict, collection: str, field: str) -> Dict[Any, set]:
+    """Primary keys of a collection's records grouped by ``field``"""
+    index = _snapshot_index(db)
+    key = ("groups", collection, field)
+    if key not in index:
+        groups = {}
+        for record in db.get(collection, []):
+            groups.setdefault(record.get(field), set()).add(_record_pk(collection, record))
+        index[key] = groups
+    return index[key]
+
+
+def collection_fields(db: Dict, collection: str) -> List[str]:
+    """Every field name used by a collection's records, in first-seen order"""
+    index = _snapshot_index(db)
+    key = ("fields", collection)
+    if key not in index:
+        fields = {}
+        for record in db.get(collection, []):
+            fields.update(dict.fromkeys(record))
+        index[key] = list(fields)
+    return index[key]
+
+
+def index_lookup(db: Dict, collection: str, field: str, values) -> set:
+    """Primary keys of records whose ``field`` is one of ``values``"""
+    groups = record_groups(db, collection, field)
+    return set().union(*(groups.get(v, ()) for v in values))
+
+
+def _parse_timestamp(record: Dict) -> Optional[datetime]:
+    try:
+        return datetime.strptime(record.get("timestamp", "2000-01-01 00:00:00"), "%Y-%m-%d %H:%M:%S")
+    except (TypeError, ValueError):
+        return None
+
+
+def record_timeline(db: Dict, collection: str) -> List[tuple]:
+    """(timestamp, primary key) of a collection's records sorted by time - timestamps are parsed only here"""
+    index = _snapshot_index(db)
+    key = ("timeline", collection)
+    if key not in index:
+        timeline = []
+        for record in db.get(collection, []):
+            timestamp = _parse_timestamp(record)
+            if timestamp is not None:
+                timeline.append((timestamp, _record_pk(collection, record)))
+        timeline.sort()
+        index[key] = timeline
+    return index[key]
+
+
+def day_range_lookup(db: Dict, collection: str, from_date: date, to_date: date) -> set:
+    """Primary keys of records timestamped between two dates (inclusive), found by binary search"""
+    timeline = record_timeline(db, collection)
+    start = bisect.bisect_left(timeline, (datetime.combine(from_date, datetime.min.time()),))
+    end = bisect.bisect_left(timeline, (datetime.combine(to_date + timedelta(days=1), datetime.min.time()),))
+    return {pk for _, pk in timeline[start:end]}
+
+
+def select_records(db: Dict, collection: str, *pk_sets: Optional[set]) -> List[Dict]:
+    """Records whose primary key is in every given set, in stored order (None sets are ignored).
+
+    Keys of records that no longer exist - say, ones picked for an export job
+    and deleted before it ran - are skipped.
+    """
+    pk_sets = sorted((pks for pks in pk_sets if pks is not None), key=len)
+    records = db.get(collection, [])
+    if not pk_sets:
+        return records
+    positions = record_positions(db, collection)
+    matches = pk_sets[0].intersection(*pk_sets[1:])
+    return [records[pos] for pos in sorted(positions[pk] for pk in matches if pk in positions)]
+
+
+def records_where(db: Dict, collection: str, field: str, values) -> List[Dict]:
+    """Records whose ``field`` is one of ``values``, in stored order"""
+    return select_records(db, collection, index_lookup(db, collection, field, values))
+
+
+def scoped_pks(db: Dict, collection: str, user: Dict, owner_field: Optional[str] = None) -> Optional[set]:
+    """Primary keys of the records visible to ``user`` - None when they can see everything.
+
+    Admin sees everything, branch staff see the records they own (by
+    ``owner_field``, nothing if it is None) and managers see their branches.
+    """
+    scope = role_scope(db, user)
+    if scope.role == "admin":
+        return None
+    if scope.role == "branch_staff":
+        return index_lookup(db, collection, owner_field, [scope.username]) if owner_field else set()
+    if scope.role in ("branch_manager", "area_manager", "AGM"):
+        return index_lookup(db, collection, "branch", scope.branches)
+    return set()
+
+
+def scoped_records(db: Dict, collection: str, user: Dict, owner_field: Optional[str] = None) -> List[Dict]:
+    """Records of a collection visible to ``user``"""
+    return select_records(db, collection, scoped_pks(db, collection, user, owner_field))
+
+
+# collection -> (staff field, extra dimensions, summed amount field) of its aggregate cells
+AGGREGATES = {
+    "leads": ("submitted_by", ("status", "department"), None),
+    "customer_leads": ("staff_name", ("lead_type", "converted"), None),
+    "insurance_entries": ("staff_id", ("status",), None),
+    "credits_fin_entries": ("user_name", ("booked",), "amount"),
+}
+AGGREGATE_FLAGS = {"converted", "booked"}
+
+
+def _aggregate_cell(collection: str, record: Dict) -> tuple:
+    """(branch, staff, day, *dimensions) cell a record is counted in"""
+    staff_field, dimensions, _ = AGGREGATES[collection]
+    day = str(record.get("timestamp", ""))[:10]
+    return (record.get("branch"), record.get(staff_field), day) + tuple(record.get(d) for d in dimensions)
+
+
+def record_aggregates(db: Dict, collection: str) -> Dict[tuple, list]:
+    """[count, amount total] of a collection's records per aggregate cell"""
+    index = _snapshot_index(db)
+    key = ("aggregates", collection)
+    if key not in index:
+        amount_field = AGGREGATES[collection][2]
+        cells = {}
+        for record in db.get(collection, []):
+            cell = cells.setdefault(_aggregate_cell(collection, record), [0, 0])
+            cell[0] += 1
+            if amount_field:
+                cell[1] += record.get(amount_field) or 0
+        index[key] = cells
+    return index[key]
+
+
+def aggregate_frame(db: Dict, collection: str, user: Optional[Dict] = None) -> pd.DataFrame:
+    """Aggregate cells visible to ``user`` as a typed DataFrame.
+
+    Branch, staff and the text dimensions are categoricals and flags are
+    booleans, so report breakdowns are single groupby/pivot passes. The
+    unscoped frame is built once per snapshot and scoped with a mask.
+    """
+    index = _snapshot_index(db)
+    key = ("frame", collection)
+    if key not in index:
+        _, dimensions, _ = AGGREGATES[collection]
+        frame = pd.DataFrame([cell + tuple(value) for cell, value in record_aggregates(db, collection).items()],
+                             columns=["branch", "staff", "day", *dimensions, "count", "amount"])
+        frame["branch"] = frame["branch"].fillna("Unassigned").astype("category")
+        frame["staff"] = frame["staff"].fillna("Unknown").astype("category")
+        for column in dimensions:
+            if column in AGGREGATE_FLAGS:
+                frame[column] = frame[column].fillna(False).astype(bool)
+            else:
+                frame[column] = frame[column].astype("category")
+        index[key] = frame
+
+    frame = index[key]
+    scope = role_scope(db, user) if user is not None else None
+    if scope is None or scope.role == "admin":
+        return frame
+    if scope.role == "branch_staff":
+        return frame[frame["staff"] == scope.username]
+    if scope.role in ("branch_manager", "area_manager", "AGM"):
+        return frame[frame["branch"].isin(scope.branches)]
+    return frame.iloc[0:0]
+
+
+def _patch_index(old: Dict, new: Dict, collection: str, rows: Dict[str, Dict]):
+    """Carry ``old``'s indexes for a collection over to ``new``, re-indexing only ``rows``.
+
+    ``rows`` maps each written primary key to its current record, or None if
+    it was deleted. Group sets are copied before they are changed, so the old
+    snapshot's index stays valid for pages still using it.
+    """
+    old_index, index = _snapshot_index(old), _snapshot_index(new)
+    old_records = old.get(collection, [])
+    old_positions = record_positions(old, collection)
+
+    if ("fields", collection) in old_index:
+        # New records only add fields at the end; a delete or a record whose
+        # keys changed can drop or reorder them, so those rebuild on next use
+        fields = dict.fromkeys(old_index[("fields", collection)])
+        for pk, record in rows.items():
+            if record is None or (pk in old_positions and list(old_records[old_positions[pk]]) != list(record)):
+                break
+            fields.update(dict.fromkeys(record))
+        else:
+            index[("fields", collection)] = list(fields)
+
+    if ("timeline", collection) in old_index:
+        timeline = list(old_index[("timeline", collection)])
+        for pk, record in rows.items():
+            if pk in old_positions:
+                timestamp = _parse_timestamp(old_records[old_positions[pk]])
+                if timestamp is not None:
+                    del timeline[bisect.bisect_left(timeline, (timestamp, pk))]
+            timestamp = _parse_timestamp(record) if record is not None else None
+            if timestamp is not None:
+                bisect.insort(timeline, (timestamp, pk))
+        index[("timeline", collection)] = timeline
+
+    for key, old_groups in old_index.items():
+        if key[:2] != ("groups", collection):
+            continue
+        field = key[2]
+        groups, copied = dict(old_groups), set()
+        for pk, record in rows.items():
+            for source, add in ((old_records[old_positions[pk]] if pk in old_positions else None, False),
+                                (record, True)):
+                if source is None:
+                    continue
+                value = source.get(field)
+                if value not in copied:
+                    groups[value] = set(groups.get(value, ()))
+                    copied.add(value)
+                if add:
+                    groups[value].add(pk)
+                else:
+                    groups[value].discard(pk)
+        index[key] = {value: pks for value, pks in groups.items() if pks}
+
+    if ("aggregates", collection) in old_index:
+        amount_field = AGGREGATES[collection][2]
+        cells = dict(old_index[("aggregates", collection)])
+        for pk, record in rows.items():
+            for source, sign in ((old_records[old_positions[pk]] if pk in old_positions else None, -1),
+                                 (record, 1)):
+                if source is None:
+                    continue
+                cell = _aggregate_cell(collection, source)
+                count, total = cells.get(cell, (0, 0))
+                amount = (source.get(amount_field) or 0) if amount_field else 0
+                cells[cell] = [count + sign, total + sign * amount]
+        index[("aggregates", collection)] = {cell: value for cell, value in cells.items() if value[0]}
+
+
+def filter_leads_by_role(db: Dict, user: Dict) -> List[Dict]:
+    """Filter leads based on user role for dashboard"""
+    return scoped_records(db, "leads", user, owner_field="submitted_by")
+
+
+def filter_insurance_by_role(db: Dict, user: Dict) -> List[Dict]:
+    """Filter insurance entries based on user role"""
+    return scoped_records(db, "insurance_entries", user, owner_field="staff_id")
+
+
+# ===========================
+# STEP 3: ADD RELIANT BEST FILTER FUNCTION
+# ===========================
+# PASTE THIS CODE AFTER filter_insurance_by_role() FUNCTION
+
+def filter_reliant_best_by_role(db: Dict, user: Dict) -> List[Dict]:
+    """Filter RELIANT BEST entries based on user role - accessible to BM, AM, AGM, Admin"""
+    # Branch Staff and others have no access
+    return scoped_records(db, "reliant_best_entries", user)
+
+
+# ====================
+# CHART CACHE - rendered report charts keyed by their input series
+# ====================
+# Each report chart is drawn to PNG once per distinct (chart, series, scope)
+# and kept in a process-wide LRU bounded by total bytes, so reruns that leave
+# the numbers unchanged never touch matplotlib. Figures are created without
+# pyplot, so none of them outlive the render that drew them.
+CHART_CACHE_MAX_BYTES = 32 * 1024 * 1024
+CHART_DPI = 200
+
+
+class BytesLRU:
+    """Thread-safe LRU of byte strings bounded by their total size"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._items: "OrderedDict[str, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "bytes": 0}
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            value = self._items.get(key)
+            if value is None:
+                self._stats["misses"] += 1
+                return None
+            self._items.move_to_end(key)
+            self._stats["hits"] += 1
+            return value
+
+    def put(self, key: str, value: bytes):
+        with self._lock:
+            if key in self._items:
+                return
+            self._items[key] = value
+            self._stats["bytes"] += len(value)
+            while self._stats["bytes"] > self.max_bytes and len(self._items) > 1:
+                _, evicted = self._items.popitem(last=False)
+                self._stats["bytes"] -= len(evicted)
+                self._stats["evictions"] += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats, entries=len(self._items))
+
+
+@st.cache_resource
+def _shared_chart_cache() -> BytesLRU:
+    return BytesLRU(CHART_CACHE_MAX_BYTES)
+
+
+_chart_cache = _shared_chart_cache()
+
+
+def _chart_key(kind: str, series: Dict, scope: RoleScope) -> str:
+    """Stable digest of a chart's input series and the scope it was drawn for"""
+    branches = sorted(scope.branches) if scope.branches is not None else None
+    points = [(str(label), float(value)) for label, value in series.items()]
+    payload = json.dumps([kind, points, scope.role, scope.username, branches])
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+def chart_cache_stats() -> Dict[str, int]:
+    """Snapshot of the chart cache counters"""
+    return _chart_cache.stats()
+
+
+def render_chart(kind: str, series: Dict, scope: RoleScope, draw) -> bytes:
+    """PNG of a report chart; draw(ax, series) only runs on a cache miss"""
+    key = _chart_key(kind, series, scope)
+    png = _chart_cache.get(key)
+    if png is not None:
+        return png
+
+    fig = Figure(figsize=(8, 5), facecolor='white')
+    try:
+        ax = fig.subplots()
+        ax.set_facecolor('white')
+        draw(ax, series)
+        fig.tight_layout()
+        buffer = BytesIO()
+        fig.savefig(buffer, format="png", dpi=CHART_DPI, bbox_inches="tight")
+        png = buffer.getvalue()
+    finally:
+        fig.clear()
+
+    _chart_cache.put(key, png)
+    return png
+
+
+def _draw_count_labels(ax, bars):
+    for bar in bars:
+        height = bar.get_height()
+        ax.text(bar.get_x() + bar.get_width() / 2., height,
+                f'{int(height)}',
+                ha='center', va='bottom', fontweight='600', fontsize=9)
+
+
+def _draw_branch_chart(ax, series: Dict):
+    bars = ax.bar(list(series.keys()), list(series.values()),
+                  color=PRIMARY_COLOR, alpha=0.85, edgecolor='white', linewidth=2)
+    ax.set_ylabel('Total Entries', fontsize=10, fontweight='600')
+    ax.set_xlabel('Branch', fontsize=10, fontweight='600')
+    ax.tick_params(axis="x", rotation=45, labelsize=9)
+    ax.tick_params(axis="y", labelsize=9)
+    ax.spines['top'].set_visible(False)
+    ax.spines['right'].set_visible(False)
+    ax.grid(axis='y', alpha=0.2)
+    _draw_count_labels(ax, bars)
+
+
+def _draw_lead_type_chart(ax, series: Dict):
+    colors_type = ['#dc2626', '#f59e0b', '#3b82f6']
+    wedges, texts, autotexts = ax.pie(
+        list(series.values()),
+        labels=list(series.keys()),
+        autopct='%1.1f%%',
+        startangle=90,
+        colors=colors_type,
+        textprops={'fontsize': 10, 'weight': '600'}
+    )
+    for autotext in autotexts:
+        autotext.set_color('white')
+
+
+def _draw_barh_chart(ax, series: Dict, color, xlabel: str):
+    ax.barh(list(series.keys()), list(series.values()),
+            color=color, alpha=0.85, edgecolor='white', linewidth=2)
+    ax.set_xlabel(xlabel, fontsize=10, fontweight='600')
+    ax.tick_params(axis="both", labelsize=9)
+    ax.spines['top'].set_visible(False)
+    ax.spines['right'].set_visible(False)
+    ax.grid(axis='x', alpha=0.2)
+
+    for i, v in enumerate(series.values()):
+        ax.text(v + 0.1, i, str(v), va='center', fontweight='600', fontsize=9)
+
+
+def _draw_insurance_status_chart(ax, series: Dict):
+    colors_ins = [INSURANCE_STATUS_COLORS.get(k, "#94a3b8") for k in
+                  ["submitted", "approved_by_branch_manager", "approved_by_area_manager", "approved_by_agm",
+                   "rejected"] if STATUS_LABELS.get(k, ("", ""))[0] in series]
+    _draw_barh_chart(ax, series, colors_ins, 'Count')
+
+
+def _draw_department_chart(ax, series: Dict):
+    _draw_barh_chart(ax, series, SECONDARY_COLOR, 'Number of Leads')
+
+
+def _draw_conversion_chart(ax, series: Dict):
+    values = list(series.values())
+    colors_conv = ['#16a34a', '#f59e0b']
+
+    bars = ax.bar(list(series.keys()), values, color=colors_conv, alpha=0.85, edgecolor='white', linewidth=2)
+    ax.set_ylabel('Count', fontsize=10, fontweight='600')
+    ax.tick_params(axis="both", labelsize=9)
+    ax.spines['top'].set_visible(False)
+    ax.spines['right'].set_visible(False)
+    ax.grid(axis='y', alpha=0.2)
+    _draw_count_labels(ax, bars)
+
+    conversion_rate = series['Converted'] / sum(values) * 100
+    ax.text(0.5, max(values) * 0.9, f'Conversion Rate: {conversion_rate:.1f}%',
+            ha='center', fontsize=11, fontweight='700',
+            bbox=dict(boxstyle='round', facecolor='white', edgecolor=PRIMARY_COLOR, linewidth=2))
+
+
+# ====================
+# EXPORT CACHE - workbooks built on download and reused
+# ====================
+# Download buttons take the callable returned by deferred_export(), so a
+# workbook is only built when someone clicks. The bytes are cached under the
+# collection, the exporter and the exact (pk, version) rows exported - the
+# filter set and the data it saw - so an unchanged report is served again
+# without touching openpyxl, and any edit to one of its rows misses.
+EXPORT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+@st.cache_resource
+def _shared_export_cache() -> BytesLRU:
+    return BytesLRU(EXPORT_CACHE_MAX_BYTES)
+
+
+_export_cache = _shared_export_cache()
+
+
+def export_cache_stats() -> Dict[str, int]:
+    """Snapshot of the export cache counters"""
+    return _export_cache.stats()
+
+
+def _deferred(key_parts: list, exporter) -> Callable[[], bytes]:
+    key = hashlib.sha1(json.dumps(key_parts).encode()).hexdigest()
+
+    def build() -> bytes:
+        content = _export_cache.get(key)
+        if content is None:
+            content = exporter().getvalue()
+            _export_cache.put(key, content)
+        return content
+
+    return build
+
+
+def deferred_export(db: Dict, collection: str, records: List[Dict], exporter) -> Callable[[], bytes]:
+    """Data callable for st.download_button that runs exporter(records, fields) on click, once per data version
+
+    ``fields`` is every field name the collection uses, so raw dumps know
+    their columns without a pass over the records.
+    """
+    versions = db.get("_versions", {}).get(collection, {})
+    rows = [(pk, versions.get(pk)) for pk in (_record_pk(collection, record) for record in records)]
+    fields = collection_fields(db, collection)
+    return _deferred([collection, exporter.__name__, fields, rows], lambda: exporter(records, fields))
+
 
-def generate_bid_id(entries: List[Dict[str, Any]]) -> str:
-    """Generate unique Bid ID - Format: BID-00001"""
-    last_id = 0
-    for entry in entries:
-        try:
-            bid = int(str(entry.get("bid_id", "")).replace("BID-", ""))
-            if bid > last_id:
-                last_id = bid
-        except ValueError:
-            continue
-    return f"BID-{str(last_id + 1).zfill(5)}"
+# ====================
+# CONSOLIDATED EXPORT - every report in one workbook
+# ====================
+# The snapshot is scoped once per collection through the same filter_*_by_role
+# rules the pages use, a Summary sheet repeats the Reports page figures from
+# the materialized aggregates, and all sheets are streamed in a single pass.
+CONSOLIDATED = "consolidated"
+CONSOLIDATED_TITLE = "All Reports"
+SUMMARY_COLUMNS = [
+    ("Section", lambda row: row[0]),
+    ("Metric", lambda row: row[1]),
+    ("Value", lambda row: row[2]),
+]
+
+
+def report_summary(db: Dict, user: Dict, sheets: Dict[str, List[Dict]]) -> List[tuple]:
+    """(section, metric, value) rows of the Reports page figures for ``user``"""
+    lead_frame = aggregate_frame(db, "leads", user)
+    customer_lead_frame = aggregate_frame(db, "customer_leads", user)
+    insurance_frame = aggregate_frame(db, "insurance_entries", user)
+    # the Reports page shows the Credits FIN dashboard unscoped, for every role
+    credits_frame = aggregate_frame(db, "credits_fin_entries")
+    total_customer_leads = int(customer_lead_frame["count"].sum())
+    converted = int(customer_lead_frame.loc[customer_lead_frame["converted"], "count"].sum())
+
+    rows = [
+        ("Overview", "System Leads", int(lead_frame["count"].sum())),
+        ("Overview", "Pending", int(lead_frame.loc[lead_frame["status"] == "submitted", "count"].sum())),
+        ("Overview", "Active Leads", total_customer_leads - converted),
+        ("Overview", "Converted", converted),
+        ("Overview", "Insurance Apps", int(insurance_frame["count"].sum())),
+        ("Overview", "Reliant Best Entries", len(sheets["Reliant Best"])),
+        ("Credits FIN", "Closed Accounts", int(credits_frame["count"].sum())),
+        ("Credits FIN", "Total Closing Amount", float(credits_frame["amount"].sum())),
+        ("Credits FIN", "Bids", len(sheets["Bids"])),
+    ]
 
-def export_to_excel(leads: List[Dict], filename: str = "crm_data.xlsx") -> BytesIO:
-    """Export leads to Excel"""
-    df = pd.DataFrame(leads)
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name='Leads')
-    output.seek(0)
-    return output
+    status_counts = {}
+    for status, count in (insurance_frame.groupby("status", observed=True, sort=False, dropna=False)["count"]
+                          .sum().items()):
+        status = status if pd.notna(status) else "submitted"
+        label = STATUS_LABELS.get(status, (status, ""))[0]
+        status_counts[label] = status_counts.get(label, 0) + int(count)
+    rows += [("Insurance Status", label, count) for label, count in status_counts.items()]
+
+    active_by_type = (customer_lead_frame[~customer_lead_frame["converted"]]
+                      .groupby("lead_type", observed=True, sort=False, dropna=False)["count"].sum())
+    rows += [("Active Lead Types", ltype if pd.notna(ltype) else "Unknown", int(count))
+             for ltype, count in active_by_type.items()]
+
+    activity = pd.concat([frame[["branch", "count"]] for frame in (lead_frame, customer_lead_frame, insurance_frame)],
+                         ignore_index=True)
+    rows += [("Branch Distribution", branch, int(count))
+             for branch, count in activity.groupby("branch", observed=True, sort=False)["count"].sum().items()]
+
+    departments = lead_frame.groupby("department", observed=True, sort=False, dropna=False)["count"].sum()
+    rows += [("Departments", dept if pd.notna(dept) else "Unknown", int(count)) for dept, count in departments.items()]
+    return rows
+
+
+def consolidated_sheets(db: Dict, user: Dict) -> List[tuple]:
+    """(sheet name, columns, records) for the summary and every report ``user`` can see"""
+    sheets = {
+        "System Leads": filter_leads_by_role(db, user),
+        "Customer Leads": scoped_records(db, "customer_leads", user, owner_field="staff_name"),
+        "Insurance": filter_insurance_by_role(db, user),
+        "Reliant Best": filter_reliant_best_by_role(db, user),
+        "Closed Accounts": filter_credits_fin_by_role(db, user),
+        "Bids": filter_bids_by_role(db, user),
+    }
+    columns = {
+        "System Leads": record_columns(collection_fields(db, "leads")),
+        "Customer Leads": record_columns(collection_fields(db, "customer_leads")),
+        "Insurance": INSURANCE_EXPORT_COLUMNS,
+        "Reliant Best": RELIANT_BEST_EXPORT_COLUMNS,
+        "Closed Accounts": record_columns(collection_fields(db, "credits_fin_entries"), CREDITS_FIN_EXPORT_ORDER),
+        "Bids": record_columns(collection_fields(db, "bids")),
+    }
+    return ([("Summary", SUMMARY_COLUMNS, report_summary(db, user, sheets))] +
+            [(name, columns[name], records) for name, records in sheets.items()])
 
 
-def export_insurance_to_excel(entries: List[Dict], filename: str = "insurance_data.xlsx") -> BytesIO:
-    """Export insurance entries to Excel without image data"""
-    export_data = []
-    for entry in entries:
-        export_data.append({
-            "Entry ID": entry.get("entry_id"),
-            "Customer ID": entry.get("customer_id"),
-            "Date": entry.get("timestamp", "").split(" ")[0],
-            "Staff ID": entry.get("staff_id"),
-            "Staff Name": entry.get("staff_name"),
-            "Branch": entry.get("branch"),
-            "Applicant Name": entry.get("applicant_name"),
-            "Age": entry.get("age"),
-            "Address": entry.get("address"),
-            "Phone": entry.get("phone_number"),
-            "Aadhar": entry.get("aadhar_number"),
-            "Insurance Type": entry.get("insurance_type"),
-            "Premium": entry.get("premium"),
-            "Status": entry.get("status"),
-            "BM Approved By": entry.get("approved_by_bm") or "Pending",
-            "BM Approval Time": entry.get("bm_approval_time") or "N/A",
-            "AM Approved By": entry.get("approved_by_am") or "Pending",
-            "AM Approval Time": entry.get("am_approval_time") or "N/A",
-            "AGM Approved By": entry.get("approved_by_agm") or "Pending",
-            "AGM Approval Time": entry.get("agm_approval_time") or "N/A",
-            "Rejection Reason": entry.get("rejection_reason") or "N/A"
-        })
+def export_consolidated(db: Dict, user: Dict, output=None, progress=None):
+    """One workbook with a Summary sheet and a sheet per report, scoped to ``user``"""
+    return write_workbook(consolidated_sheets(db, user), output, progress)
 
-    df = pd.DataFrame(export_data)
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name='Insurance')
-    output.seek(0)
-    return output
 
-# ===========================
-# STEP 2: ADD RELIANT BEST EXPORT FUNCTION
-# ===========================
-# PASTE THIS CODE AFTER export_insurance_to_excel() FUNCTION
-def export_reliant_best_to_excel(entries: List[Dict]) -> BytesIO:
-    """Export RELIANT BEST entries to Excel with GOLD and PL in ONE row"""
-    export_data = []
-    for entry in entries:
-        # Create single row with all GOLD and PL data
-        row_data = {
-            "Entry ID": entry.get("entry_id"),
-            "Customer ID(GL)": entry.get("customer_id_gl", ""),
-            "Date": entry.get("timestamp", "").split(" ")[0],
-            "Staff ID": entry.get("staff_id"),
-            "Staff Name": entry.get("staff_name"),
-            "Branch": entry.get("branch"),
-            # GOLD Section
-            "Section": "GOLD & PL",
-            "GL Loan Number": entry.get("gold_loan_number", ""),
-            "GL Name": entry.get("gold_name", ""),
-            "Gross Weight (grams)": entry.get("gold_gross_weight", ""),
-            "Net Weight (grams)": entry.get("gold_net_weight", ""),
-            "Gold Amount": entry.get("gold_amount", ""),
-            # PL Section
-            "Customer ID(PL)": entry.get("customer_id_pl", ""),
-            "PL Loan Number": entry.get("pl_loan_number", ""),
-            "PL Name": entry.get("pl_name", ""),
-            "PL Amount": entry.get("pl_amount", "")
-        }
-        export_data.append(row_data)
-    df = pd.DataFrame(export_data)
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name='Reliant Best')
-    output.seek(0)
-    return output
+def deferred_consolidated_export(db: Dict, user: Dict) -> Callable[[], bytes]:
+    """Data callable for the consolidated workbook, cached per journal head and role scope"""
+    scope = role_scope(db, user)
+    branches = sorted(scope.branches) if scope.branches is not None else None
+    return _deferred([CONSOLIDATED, db.get("_head"), scope.role, scope.username, branches],
+                     lambda: export_consolidated(db, user))
 
-def get_image_base64(image_path: str) -> str:
-    """Convert image to base64 for display"""
-    try:
-        with open(image_path, "rb") as img_file:
-            return base64.b64encode(img_file.read()).decode()
-    except:
-        return ""
 
-def filter_leads_by_role(leads: List[Dict], user: Dict) -> List[Dict]:
-    """Filter leads based on user role for dashboard"""
-    role = user.get("role")
-    username = user.get("username")
+# ====================
+# EXPORT JOBS - large exports built on a background thread pool
+# ====================
+# A job is a row in export_jobs whose spec holds the filters the user chose
+# and the primary keys they selected. A pool worker re-applies the owner's
+# current role scope to those keys, streams the rows into EXPORT_DIR and
+# records progress as it goes, so the page that queued it stays responsive
+# and the file can be downloaded from any later session. Several server
+# processes can share the database, so each one stamps the jobs it holds
+# with a heartbeat; a job whose heartbeat goes stale lost its process and is
+# marked failed by whichever process looks next.
+EXPORT_WORKERS = 2
+EXPORT_JOB_HISTORY = 10
+EXPORT_POLL_SECONDS = 2
+EXPORT_HEARTBEAT_SECONDS = 15
+EXPORT_STALE_SECONDS = 60
+
+# collection -> (title, sheet name, columns for a snapshot, pks a user may export)
+EXPORT_LAYOUTS = {
+    "leads": ("System Leads", "Leads", lambda db: record_columns(collection_fields(db, "leads")),
+              lambda db, user: scoped_pks(db, "leads", user, owner_field="submitted_by")),
+    "customer_leads": ("Customer Leads", "Leads", lambda db: record_columns(collection_fields(db, "customer_leads")),
+                       lambda db, user: scoped_pks(db, "customer_leads", user, owner_field="staff_name")),
+    "insurance_entries": ("Insurance Applications", "Insurance", lambda db: INSURANCE_EXPORT_COLUMNS,
+                          lambda db, user: scoped_pks(db, "insurance_entries", user, owner_field="staff_id")),
+    "credits_fin_entries": ("Closed Accounts", "Closed Accounts",
+                            lambda db: record_columns(collection_fields(db, "credits_fin_entries"),
+                                                      CREDITS_FIN_EXPORT_ORDER),
+                            lambda db, user: credits_fin_scope(db, user)),
+}
 
-    if role == "admin":
-        return leads
-    elif role == "branch_staff":
-        return [l for l in leads if l.get("submitted_by") == username]
-    elif role == "branch_manager":
-        assigned_branches = user.get("assigned_branches", [])
-        return [l for l in leads if l.get("branch") in assigned_branches]
-    elif role == "area_manager":
-        assigned_branches = user.get("assigned_branches", [])
-        return [l for l in leads if l.get("branch") in assigned_branches]
-    elif role == "AGM":
+
+def _now() -> str:
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _export_worker() -> str:
+    """Identifies this server process on the jobs it runs"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _fail_orphaned_export_jobs():
+    """Mark failed the unfinished jobs whose process stopped refreshing their heartbeat"""
+    conn = get_connection()
+    orphaned = "status IN ('queued', 'running') AND (heartbeat IS NULL OR heartbeat < ?)"
+    stale = time.time() - EXPORT_STALE_SECONDS
+    if conn.execute(f"SELECT 1 FROM export_jobs WHERE {orphaned} LIMIT 1", (stale,)).fetchone() is None:
+        return
+    with write_transaction(conn):
+        conn.execute("UPDATE export_jobs SET status = 'failed', error = 'Interrupted - the server running it stopped', "
+                     f"finished_at = ? WHERE {orphaned}", (_now(), stale))
+
+
+def _export_heartbeat(worker: str):
+    """Keep this process's unfinished jobs from looking orphaned - runs for the process lifetime"""
+    while True:
+        conn = get_connection()
+        with write_transaction(conn):
+            conn.execute("UPDATE export_jobs SET heartbeat = ? WHERE worker = ? AND status IN ('queued', 'running')",
+                         (time.time(), worker))
+        time.sleep(EXPORT_HEARTBEAT_SECONDS)
+
+
+@st.cache_resource
+def _export_pool() -> ThreadPoolExecutor:
+    _fail_orphaned_export_jobs()
+    threading.Thread(target=_export_heartbeat, args=(_export_worker(),), name="export-heartbeat", daemon=True).start()
+    return ThreadPoolExecutor(max_workers=EXPORT_WORKERS, thread_name_prefix="export")
+
+
+def _update_export_job(job_id: int, **fields):
+    conn = get_connection()
+    assignments = ", ".join(f"{name} = ?" for name in fields)
+    with write_transaction(conn):
+        conn.execute(f"UPDATE export_jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+
+def submit_export_job(user: Dict, collection: str, records: Optional[List[Dict]], fmt: str,
+                      filters: Dict[str, Any]) -> int:
+    """Queue a background export of ``records`` as "xlsx" or "csv" and return the job id
+
+    ``collection`` may be CONSOLIDATED, with no records, for the all-reports workbook.
+    """
+    pool = _export_pool()
+    pks = None if records is None else [_record_pk(collection, record) for record in records]
+    spec = {"filters": filters, "pks": pks}
+    conn = get_connection()
+    with write_transaction(conn):
+        job_id = conn.execute(
+            "INSERT INTO export_jobs (owner, collection, format, spec, status, created_at, worker, heartbeat) "
+            "VALUES (?, ?, ?, ?, 'queued', ?, ?, ?)",
+            (user["username"], collection, fmt, _encode(spec), _now(), _export_worker(), time.time())
+        ).lastrowid
+        expired = conn.execute(
+            "SELECT id, path FROM export_jobs WHERE owner = ? AND status IN ('done', 'failed') "
+            "ORDER BY id DESC LIMIT -1 OFFSET ?", (user["username"], EXPORT_JOB_HISTORY)
+        ).fetchall()
+        conn.executemany("DELETE FROM export_jobs WHERE id = ?", [(old_id,) for old_id, _ in expired])
+    for _, path in expired:
+        if path and os.path.exists(path):
+            os.remove(path)
+    pool.submit(_run_export_job, job_id)
+    return job_id
+
+
+def _run_export_job(job_id: int):
+    """Build one queued export - runs on a pool thread"""
+    conn = get_connection()
+    owner, collection, fmt, spec = conn.execute(
+        "SELECT owner, collection, format, spec FROM export_jobs WHERE id = ?", (job_id,)).fetchone()
+    path = os.path.join(EXPORT_DIR, f"{collection}_{job_id}.{fmt}")
+    tmp_path = f"{path}.tmp"
+    try:
+        _update_export_job(job_id, status="running")
         db = load_data()
-        ams = [u for u, d in db["users"].items()
-               if d.get("created_by") == username and d.get("role") == "area_manager"]
-        branches = []
-        for am in ams:
-            branches.extend(db["users"][am].get("assigned_branches", []))
-        return [l for l in leads if l.get("branch") in branches]
-    else:
-        return []
+        user = db["users"].get(owner)
+        if user is None:
+            raise ValueError(f"User {owner} no longer exists")
+        if collection == CONSOLIDATED:
+            sheets = consolidated_sheets(db, user)
+        else:
+            _, sheet_name, columns_for, allowed_pks = EXPORT_LAYOUTS[collection]
+            records = select_records(db, collection, set(json.loads(spec)["pks"]), allowed_pks(db, user))
+            sheets = [(sheet_name, columns_for(db), records)]
+        total = sum(len(records) for _, _, records in sheets)
+
+        def progress(done: int):
+            _update_export_job(job_id, progress=done / total)
+
+        with open(tmp_path, "wb") as f:
+            if fmt == "csv":
+                _, columns, records = sheets[0]
+                write_csv(columns, records, f, progress)
+            else:
+                write_workbook(sheets, f, progress)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        _update_export_job(job_id, status="done", progress=1.0, rows=total, path=path, finished_at=_now())
+    except Exception as e:
+        _update_export_job(job_id, status="failed", error=str(e), finished_at=_now())
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
 
-def filter_insurance_by_role(entries: List[Dict], user: Dict, db: Dict) -> List[Dict]:
-    """Filter insurance entries based on user role"""
-    role = user.get("role")
-    username = user.get("username")
+def export_jobs_for(username: str) -> List[Dict]:
+    """The user's most recent export jobs, newest first"""
+    _export_pool()
+    _fail_orphaned_export_jobs()
+    cursor = get_connection().execute(
+        "SELECT id, collection, format, spec, status, progress, rows, path, error, created_at "
+        "FROM export_jobs WHERE owner = ? ORDER BY id DESC LIMIT ?", (username, EXPORT_JOB_HISTORY))
+    columns = [column[0] for column in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor]
 
-    if role == "admin":
-        return entries
-    elif role == "branch_staff":
-        return [e for e in entries if e.get("staff_id") == username]
-    elif role == "branch_manager":
-        assigned_branches = user.get("assigned_branches", [])
-        return [e for e in entries if e.get("branch") in assigned_branches]
-    elif role == "area_manager":
-        assigned_branches = user.get("assigned_branches", [])
-        return [e for e in entries if e.get("branch") in assigned_branches]
-    elif role == "AGM":
-        ams = [u for u, d in db["users"].items()
-               if d.get("created_by") == username and d.get("role") == "area_manager"]
-        branches = []
-        for am in ams:
-            branches.extend(db["users"][am].get("assigned_branches", []))
-        return [e for e in entries if e.get("branch") in branches]
-    else:
-        return []
 
+def _read_export(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
 
-# ===========================
-# STEP 3: ADD RELIANT BEST FILTER FUNCTION
-# ===========================
-# PASTE THIS CODE AFTER filter_insurance_by_role() FUNCTION
 
-def filter_reliant_best_by_role(entries: List[Dict], user: Dict, db: Dict) -> List[Dict]:
-    """Filter RELIANT BEST entries based on user role - accessible to BM, AM, AGM, Admin"""
-    role = user.get("role")
-    username = user.get("username")
+def background_export_button(user: Dict, collection: str, records: List[Dict], fmt: str,
+                             filters: Dict[str, Any], key: str):
+    """Button that queues ``records`` as a background export job"""
+    if st.button("⏳ Build in background", key=key, use_container_width=True,
+                 help="Build the file on the server and download it from Background Exports when ready"):
+        job_id = submit_export_job(user, collection, records, fmt, filters)
+        st.success(f"✅ Export #{job_id} queued - it will appear under Background Exports")
 
-    if role == "admin":
-        # Admin sees all entries
-        return entries
 
-    elif role == "branch_manager":
-        # Branch Manager sees entries from their assigned branches
-        assigned_branches = user.get("assigned_branches", [])
-        return [e for e in entries if e.get("branch") in assigned_branches]
+def export_jobs_panel(user: Dict):
+    """The user's background exports, polling while any of them is still being built"""
+    polling = any(job["status"] in ("queued", "running") for job in export_jobs_for(user["username"]))
 
-    elif role == "area_manager":
-        # Area Manager sees entries from their assigned branches
-        assigned_branches = user.get("assigned_branches", [])
-        return [e for e in entries if e.get("branch") in assigned_branches]
+    @st.fragment(run_every=EXPORT_POLL_SECONDS if polling else None)
+    def panel():
+        jobs = export_jobs_for(user["username"])
+        if not jobs:
+            return
+        st.markdown("#### ⏳ Background Exports")
+        for job in jobs:
+            filters = json.loads(job["spec"])["filters"]
+            title = CONSOLIDATED_TITLE if job["collection"] == CONSOLIDATED else EXPORT_LAYOUTS[job["collection"]][0]
+            label = (f"#{job['id']} {title} ({job['format'].upper()}) - "
+                     f"{job['created_at'][:16]}")
+            chosen = ", ".join(f"{name}: {value}" for name, value in filters.items() if value not in ("All", "", None))
+            if job["status"] == "done" and job["path"] and os.path.exists(job["path"]):
+                st.download_button(
+                    label=f"📥 {label} - {job['rows']} records",
+                    data=lambda path=job["path"]: _read_export(path),
+                    on_click="ignore",
+                    file_name=os.path.basename(job["path"]),
+                    mime="text/csv" if job["format"] == "csv" else XLSX_MIME,
+                    key=f"export_job_{job['id']}",
+                    help=chosen or None,
+                    use_container_width=True
+                )
+            elif job["status"] == "failed":
+                st.error(f"{label} failed: {job['error']}")
+            elif job["status"] == "done":
+                st.caption(f"{label} - file no longer available")
+            else:
+                st.progress(job["progress"], text=f"{label} - {job['status']} ({job['progress']:.0%})")
+        if polling and not any(job["status"] in ("queued", "running") for job in jobs):
+            st.rerun()
+
+    panel()
+
+
+# ====================
+# ANALYTICS SNAPSHOT - typed Parquet copies of the collections
+# ====================
+# Each collection (except users) is written as Parquet under ANALYTICS_DIR,
+# hive-partitioned by month and branch, with explicit column types so money
+# fields stay floats and timestamps stay timestamps when read back with
+# pd.read_parquet(<dir>). A manifest records the journal head the snapshot
+# reflects and which partition every record sits in; a refresh rewrites only
+# the partitions touched by journal entries since then, falling back to a
+# full rewrite when the journal was compacted or a collection gained fields.
+ANALYTICS_DIR = os.path.join(UPLOAD_DIR, "analytics")
+ANALYTICS_MANIFEST = os.path.join(ANALYTICS_DIR, "_manifest.json")
+ANALYTICS_COLLECTIONS = [name for name in COLLECTION_KEYS if name != "users"]
+ANALYTICS_FLOAT_FIELDS = {"premium", "gold_gross_weight", "gold_net_weight", "gold_amount", "pl_amount",
+                          "total_amount", "amount", "scheme", "gps_lat", "gps_lon"}
+ANALYTICS_INT_FIELDS = {"age", "followup_count"}
+ANALYTICS_BOOL_FIELDS = {"converted", "booked"}
+ANALYTICS_DATETIME_FIELDS = {"timestamp", "created_at", "maturity", "last_followup"}
+
+
+@st.cache_resource
+def _analytics_lock() -> threading.Lock:
+    return threading.Lock()
+
+
+def _analytics_type(field: str):
+    if field in ANALYTICS_FLOAT_FIELDS:
+        return pa.float64()
+    if field in ANALYTICS_INT_FIELDS:
+        return pa.int64()
+    if field in ANALYTICS_BOOL_FIELDS:
+        return pa.bool_()
+    if field in ANALYTICS_DATETIME_FIELDS or field.endswith(("_time", "_date")):
+        return pa.timestamp("us")
+    return pa.string()
+
+
+def _analytics_partition(record: Dict) -> tuple:
+    """(month, branch) a record is filed under"""
+    timestamp = str(record.get("timestamp") or "")
+    month = timestamp[:7] if len(timestamp) >= 7 and timestamp[4] == "-" else "unknown"
+    return month, str(record.get("branch") or "Unassigned")
+
+
+def _analytics_frame(records: List[Dict], columns: List[str]):
+    """Arrow table of ``records`` with every column cast to its analytics type"""
+    frame = pd.DataFrame.from_records(records, columns=columns)
+    fields = []
+    for column in columns:
+        kind = _analytics_type(column)
+        values = frame[column]
+        if kind == pa.float64():
+            frame[column] = pd.to_numeric(values, errors="coerce").astype("float64")
+        elif kind == pa.int64():
+            frame[column] = pd.to_numeric(values, errors="coerce").round().astype("Int64")
+        elif kind == pa.bool_():
+            frame[column] = values.map(lambda v: None if v is None or v != v else bool(v)).astype("boolean")
+        elif kind == pa.timestamp("us"):
+            frame[column] = pd.to_datetime(values.map(lambda v: v if isinstance(v, str) else None),
+                                           format="mixed", errors="coerce")
+        else:
+            frame[column] = values.map(
+                lambda v: None if v is None or (isinstance(v, float) and v != v)
+                else json.dumps(v, default=str) if isinstance(v, (dict, list)) else str(v))
+        fields.append(pa.field(column, kind))
+    return pa.Table.from_pandas(frame, schema=pa.schema(fields), preserve_index=False)
+
+
+def _analytics_partition_path(collection: str, partition: tuple) -> str:
+    month, branch = partition
+    return os.path.join(ANALYTICS_DIR, collection, f"month={quote(month, safe='')}",
+                        f"branch={quote(branch, safe='')}", "part-0.parquet")
+
+
+def analytics_snapshot_status() -> Optional[Dict]:
+    """The manifest of the last analytics snapshot, or None if there is none yet"""
+    try:
+        with open(ANALYTICS_MANIFEST) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def refresh_analytics_snapshot() -> Dict[str, int]:
+    """Bring the Parquet snapshot up to date and return the partitions rewritten per collection"""
+    with _analytics_lock():
+        db = load_data()
+        head = db["_head"]
+        manifest = analytics_snapshot_status() or {"head": None, "collections": {}}
+        changes = changes_since(manifest["head"]) if manifest["head"] is not None else None
+        changed = None
+        if changes is not None:
+            changed = {}
+            for seq, collection, pk, _ in changes:
+                if seq <= head:
+                    changed.setdefault(collection, set()).add(pk)
+
+        rewritten = {}
+        for collection in ANALYTICS_COLLECTIONS:
+            records = db.get(collection, [])
+            columns = list(dict.fromkeys(key for record in records for key in record if key != "branch"))
+            previous = manifest["collections"].get(collection)
+            partitions = {_record_pk(collection, record): _analytics_partition(record) for record in records}
+
+            if changed is None or previous is None or previous["columns"] != columns:
+                shutil.rmtree(os.path.join(ANALYTICS_DIR, collection), ignore_errors=True)
+                dirty = set(partitions.values())
+            else:
+                old_partitions = previous["partitions"]
+                dirty = set()
+                for pk in changed.get(collection, ()):
+                    if pk in old_partitions:
+                        dirty.add(tuple(old_partitions[pk]))
+                    if pk in partitions:
+                        dirty.add(partitions[pk])
+
+            grouped = {partition: [] for partition in dirty}
+            for record in records:
+                partition = partitions[_record_pk(collection, record)]
+                if partition in grouped:
+                    grouped[partition].append(record)
+            for partition, members in grouped.items():
+                path = _analytics_partition_path(collection, partition)
+                if not members:
+                    if os.path.exists(path):
+                        os.remove(path)
+                    continue
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.tmp"
+                pq.write_table(_analytics_frame(members, columns), tmp_path)
+                os.replace(tmp_path, path)
+
+            rewritten[collection] = len(dirty)
+            manifest["collections"][collection] = {"columns": columns, "rows": len(records),
+                                                   "partitions": {pk: list(p) for pk, p in partitions.items()}}
+
+        manifest["head"] = head
+        manifest["refreshed_at"] = _now()
+        os.makedirs(ANALYTICS_DIR, exist_ok=True)
+        atomic_write(ANALYTICS_MANIFEST, json.dumps(manifest).encode())
+    return rewritten
 
-    elif role == "AGM":
-        # AGM sees all entries under their assigned area managers' branches
-        ams = [u for u, d in db["users"].items()
-               if d.get("created_by") == username and d.get("role") == "area_manager"]
-        branches = []
-        for am in ams:
-            branches.extend(db["users"][am].get("assigned_branches", []))
-        return [e for e in entries if e.get("branch") in branches]
 
-    else:
-        # Branch Staff and others have no access
-        return []
 # ====================
 # INITIALIZE DATABASE
 # ====================
 db = load_data()
 if "ADMIN" not in db["users"]:
-    db["users"]["ADMIN"] = {
+    insert_record("users", {
         "username": "ADMIN",
         "password": hash_password("ADMIN123#"),
         "role": "admin",
@@ -460,8 +2227,7 @@ if "ADMIN" not in db["users"]:
         "assigned_products": [],
         "created_by": "system",
         "created_at": str(datetime.now())
-    }
-    save_data(db)
+    })
 
 # ====================
 # SESSION STATE INITIALIZATION
@@ -502,6 +2268,36 @@ if "credits_fin_page" not in st.session_state:
     st.session_state.credits_fin_page = "main"
 if "manage_credits_fin_page" not in st.session_state:
     st.session_state.manage_credits_fin_page = "main"
+if "flash_messages" not in st.session_state:
+    st.session_state.flash_messages = []
+
+
+# ====================
+# FLASH MESSAGES
+# ====================
+# Notices raised just before st.rerun() are queued in session state and shown
+# at the top of the next run, so a write never sleeps to keep them on screen.
+def flash(message: str, kind: str = "success", balloons: bool = False):
+    """Queue a notice for the next run - ``kind`` is the st function that shows it"""
+    st.session_state.flash_messages.append((kind, message, balloons))
+
+
+def show_legacy_import_repairs(repairs: List[str]):
+    """Tell an admin which legacy records were re-keyed on import, until dismissed"""
+    st.warning("⚠️ Some records in the imported crm_data.json had a missing or repeated ID and were given a "
+               "new one (the old ID is kept on the record):\n\n" + "\n".join(f"- {line}" for line in repairs))
+    if st.button("Dismiss", key="dismiss_legacy_import_repairs"):
+        set_value("legacy_import_repairs", [])
+        st.rerun()
+
+
+def show_flash_messages():
+    """Show and clear the queued notices"""
+    messages, st.session_state.flash_messages = st.session_state.flash_messages, []
+    for kind, message, balloons in messages:
+        getattr(st, kind)(message)
+        if balloons:
+            st.balloons()
 
 
 ## ====================
@@ -924,6 +2720,69 @@ def apply_custom_css():
 # Apply CSS only once at module initialization
 apply_custom_css()
 
+# ====================
+# PAGINATION - record lists rendered one page at a time
+# ====================
+# Management pages draw an expander per record, so only the current page of
+# the filtered list is rendered. A page is addressed by a cursor - the primary
+# key of its first record - which keeps it in place when records before it are
+# approved or deleted; the offset is kept as a fallback for when the cursor
+# record itself drops out of the list.
+PAGE_SIZES = [10, 25, 50, 100]
+DEFAULT_PAGE_SIZE = 25
+
+
+class PageCursor(NamedTuple):
+    """First record of a page: its primary key and its position when the page was opened"""
+    pk: Optional[str]
+    offset: int
+
+
+def page_window(collection: str, records: List[Dict], cursor: PageCursor, size: int) -> tuple:
+    """(start, previous page cursor, next page cursor) for the page at ``cursor`` - cursors are None at the ends"""
+    start = cursor.offset
+    if cursor.pk is not None:
+        for pos, record in enumerate(records):
+            if _record_pk(collection, record) == cursor.pk:
+                start = pos
+                break
+    start = max(0, min(start, (len(records) - 1) // size * size))
+
+    def cursor_at(pos: int) -> PageCursor:
+        return PageCursor(_record_pk(collection, records[pos]), pos)
+
+    previous = cursor_at(max(0, start - size)) if start > 0 else None
+    following = cursor_at(start + size) if start + size < len(records) else None
+    return start, previous, following
+
+
+def _set_page_cursor(key: str, cursor: PageCursor):
+    st.session_state[f"{key}_cursor"] = cursor
+
+
+def paginate(collection: str, records: List[Dict], key: str) -> List[Dict]:
+    """Draw the page controls for ``records`` and return the records on the current page"""
+    if not records:
+        return records
+    cursor = st.session_state.get(f"{key}_cursor", PageCursor(None, 0))
+    size = st.session_state.get(f"{key}_size", DEFAULT_PAGE_SIZE)
+    start, previous, following = page_window(collection, records, cursor, size)
+    page = records[start:start + size]
+
+    col_size, col_info, col_prev, col_next = st.columns([1, 2, 1, 1])
+    with col_size:
+        st.selectbox("Per page", PAGE_SIZES, index=PAGE_SIZES.index(DEFAULT_PAGE_SIZE),
+                     key=f"{key}_size", label_visibility="collapsed")
+    with col_info:
+        st.caption(f"Showing {start + 1}-{start + len(page)} of {len(records)}")
+    with col_prev:
+        st.button("◀ Prev", key=f"{key}_prev", disabled=previous is None, use_container_width=True,
+                  on_click=_set_page_cursor, args=(key, previous))
+    with col_next:
+        st.button("Next ▶", key=f"{key}_next", disabled=following is None, use_container_width=True,
+                  on_click=_set_page_cursor, args=(key, following))
+    return page
+
 # ====================
 # GPS COMPONENT
 # ====================
@@ -1169,6 +3028,66 @@ def render_gps_component():
 
     return components.html(gps_html, height=250, scrolling=False)
 
+
+# ====================
+# REVIEW GATE
+# ====================
+# Approvers must keep an application open for REVIEW_SECONDS before acting on
+# it. The countdown runs in the browser, so waiting costs no reruns; the
+# server only checks the recorded open time when Approve/Reject is clicked.
+# Bulk actions only apply to records whose own review time has already run.
+REVIEW_SECONDS = 10
+REVIEW_GATED_ROLES = ["branch_manager", "area_manager"]
+
+
+def review_time_left(open_times: Dict[str, float], key: str) -> int:
+    """Seconds of review still required for ``key``, starting its clock on first sight"""
+    opened = open_times.setdefault(key, time.time())
+    return max(0, REVIEW_SECONDS - int(time.time() - opened))
+
+
+def render_review_gate(open_times: Dict[str, float], key: str, message: str) -> int:
+    """Show a browser-side countdown while the review time runs and return the seconds left"""
+    remaining = review_time_left(open_times, key)
+    if remaining > 0:
+        components.html(f"""
+        <div id="gate" style="background: linear-gradient(135deg, #f59e0b 0%, #ea580c 100%); color: white;
+             padding: 1rem 1.5rem; border-radius: 8px; font-weight: 600; text-align: center;
+             font-family: sans-serif;">
+            ⏳ {message} <span id="left">{remaining}</span> seconds...
+        </div>
+        <script>
+            let left = {remaining};
+            const timer = setInterval(function() {{
+                left -= 1;
+                if (left > 0) {{
+                    document.getElementById('left').textContent = left;
+                    return;
+                }}
+                clearInterval(timer);
+                const gate = document.getElementById('gate');
+                gate.style.background = '#16a34a';
+                gate.textContent = '✅ Review complete - you can act on this record now.';
+            }}, 1000);
+        </script>
+        """, height=70)
+    return remaining
+
+
+def unreviewed(open_times: Dict[str, float], username: str, pks: List[str]) -> List[str]:
+    """The ``pks`` that ``username`` has not kept open for REVIEW_SECONDS - without starting any clock"""
+    now = time.time()
+    return [pk for pk in pks if now - open_times.get(f"{username}_{pk}", now) < REVIEW_SECONDS]
+
+
+def review_gate_passed(open_times: Dict[str, float], key: str) -> bool:
+    """Enforce the review time at submit, warning when the action came too early"""
+    remaining = review_time_left(open_times, key)
+    if remaining > 0:
+        st.warning(f"⏳ Please keep reviewing - actions unlock in {remaining} more seconds.")
+        return False
+    return True
+
 # ===========================
 # STEP 7: CREATE RELIANT BEST ENTRY PAGE FUNCTION
 # ===========================
@@ -1234,7 +3153,7 @@ def reliant_best_entry_page(user, db_local):
                     st.error(error)
             else:
                 new_entry = {
-                    "entry_id": generate_reliant_best_entry_id(db_local.get("reliant_best_entries", [])),
+                    "entry_id": generate_reliant_best_entry_id(),
                     "customer_id_gl": gl_customer_id,  # Save the user-entered GL Customer ID
                     "customer_id_pl": pl_customer_id,  # Save the user-entered PL Customer ID
                     "staff_id": user.get("username"),
@@ -1250,8 +3169,7 @@ def reliant_best_entry_page(user, db_local):
                     "pl_amount": pl_amount,
                     "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
                 }
-                db_local["reliant_best_entries"].append(new_entry)
-                save_data(db_local)
+                insert_record("reliant_best_entries", new_entry)
                 st.success("✅ RELIANT BEST Entry saved successfully!")
                 st.balloons()
                 st.stop()
@@ -1317,8 +3235,8 @@ def reliant_best_management_page(user, db_local):
 
     # RELOAD DATA
     db_fresh = load_data()
-    all_entries = db_fresh.get("reliant_best_entries", [])
-    entries = filter_reliant_best_by_role(all_entries, user, db_fresh)
+    scope = scoped_pks(db_fresh, "reliant_best_entries", user)
+    entries = select_records(db_fresh, "reliant_best_entries", scope)
 
     if not entries:
         st.info("No RELIANT BEST entries found.")
@@ -1361,23 +3279,23 @@ def reliant_best_management_page(user, db_local):
     st.markdown('<div style="margin:1rem 0;"></div>', unsafe_allow_html=True)
 
     # Apply filters
-    filtered = entries
-    if branch_filter != "All":
-        filtered = [e for e in filtered if e.get("branch") == branch_filter]
-    if staff_filter != "All":
-        filtered = [e for e in filtered if e.get("staff_id") == staff_filter]
-    filtered = [e for e in filtered if from_date <= datetime.strptime(e.get("timestamp", "2000-01-01 00:00:00"), "%Y-%m-%d %H:%M:%S").date() <= to_date]
+    filtered = select_records(
+        db_fresh, "reliant_best_entries", scope,
+        index_lookup(db_fresh, "reliant_best_entries", "branch", [branch_filter]) if branch_filter != "All" else None,
+        index_lookup(db_fresh, "reliant_best_entries", "staff_id", [staff_filter]) if staff_filter != "All" else None,
+        day_range_lookup(db_fresh, "reliant_best_entries", from_date, to_date),
+    )
 
     st.markdown(f"**Found {len(filtered)} records**")
 
     # Download button
     if filtered:
-        excel_data = export_reliant_best_to_excel(filtered)
         st.download_button(
             label=f"📥 Download Excel Report ({len(filtered)} records)",
-            data=excel_data,
+            data=deferred_export(db_fresh, "reliant_best_entries", filtered, export_reliant_best_to_excel),
+            on_click="ignore",
             file_name=f"reliant_best_{role}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            mime=XLSX_MIME,
             type="primary",
             use_container_width=True
         )
@@ -1386,7 +3304,7 @@ def reliant_best_management_page(user, db_local):
 
     # Display entries
     st.markdown("### 📋 RELIANT BEST Entries")
-    for entry in filtered:
+    for entry in paginate("reliant_best_entries", filtered, key="reliant_best_pager"):
         entry_id = entry.get("entry_id")
         customer_id_gl = entry.get("customer_id_gl") or '-'
         customer_id_pl = entry.get("customer_id_pl") or '-'
@@ -1455,39 +3373,34 @@ def reliant_best_management_page(user, db_local):
             if role == "AGM":
                 if st.button(f"🗑️ Delete Entry", key=f"delete_{entry_id}", use_container_width=True):
                     try:
-                        db_fresh["reliant_best_entries"] = [
-                            e for e in db_fresh["reliant_best_entries"] if e.get("entry_id") != entry_id
-                        ]
-                        save_data(db_fresh)
-                        st.success("✅ Entry deleted successfully!")
+                        delete_record("reliant_best_entries", entry_id)
+                        flash("✅ Entry deleted successfully!")
                         st.rerun()  # <-- Updated
                     except Exception as e:
                         st.error(f"❌ Failed to delete entry: {e}")
 
 
-def filter_credits_fin_by_role(entries: List[Dict], user: Dict) -> List[Dict]:
-    """Filter Credits FIN entries by role"""
+def credits_fin_scope(db: Dict, user: Dict) -> Optional[set]:
+    """Primary keys of the Credits FIN entries ``user`` can see - None for all"""
     role = user.get("role")
-    username = user.get("username")
-    if role == "admin":
-        return entries
+    if role in ("admin", "AGM"):
+        return None  # AGM sees all for management
     elif role == "branch_manager":
-        assigned_branches = user.get("assigned_branches", [])
-        return [e for e in entries if e.get("branch") in assigned_branches]
-    elif role == "AGM":
-        return entries  # AGM sees all for management
-    return []
+        return scoped_pks(db, "credits_fin_entries", user)
+    return set()
 
-def filter_bids_by_role(entries: List[Dict], user: Dict) -> List[Dict]:
+
+def filter_credits_fin_by_role(db: Dict, user: Dict) -> List[Dict]:
+    """Filter Credits FIN entries by role"""
+    return select_records(db, "credits_fin_entries", credits_fin_scope(db, user))
+
+def filter_bids_by_role(db: Dict, user: Dict) -> List[Dict]:
     """Filter Bids by role"""
     role = user.get("role")
-    username = user.get("username")
-    if role == "admin":
-        return entries
+    if role in ("admin", "AGM"):
+        return db.get("bids", [])  # AGM sees all for approval
     elif role == "branch_manager":
-        return [e for e in entries if e.get("bidder") == username]
-    elif role == "AGM":
-        return entries  # AGM sees all for approval
+        return records_where(db, "bids", "bidder", [user.get("username")])
     return []
 
 
@@ -1530,8 +3443,7 @@ def login_page():
                         st.session_state.insurance_open_times = {}
                         st.session_state.delete_confirm = {}
                         st.session_state.gps_data = None
-                        st.success(f"✅ Welcome, {username}!")
-                        time.sleep(0.5)
+                        flash(f"✅ Welcome, {username}!")
                         st.rerun()
                     else:
                         st.error("❌ Invalid password.")
@@ -1699,12 +3611,10 @@ def insurance_application_page(user, db_local):
                 filename = f"aadhar_{staff_id}_{timestamp}.{file_ext}"
                 file_path = os.path.join(AADHAR_DIR, filename)
 
-                with open(file_path, "wb") as f:
-                    f.write(aadhar_file.getbuffer())
+                atomic_write(file_path, aadhar_file.getbuffer())
 
-                insurance_entries = db_local.get("insurance_entries", [])
-                entry_id = generate_insurance_entry_id(insurance_entries)
-                customer_id = generate_insurance_customer_id(insurance_entries)
+                entry_id = generate_insurance_entry_id()
+                customer_id = generate_insurance_customer_id()
 
                 new_entry = {
                     "entry_id": entry_id,
@@ -1732,14 +3642,9 @@ def insurance_application_page(user, db_local):
                     "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
                 }
 
-                insurance_entries.append(new_entry)
-                db_local["insurance_entries"] = insurance_entries
-
-                if save_data(db_local):
-                    st.success(f"✅ Application submitted successfully!")
-                    st.success(f"📋 Entry ID: {entry_id} | Customer ID: {customer_id}")
-                    st.balloons()
-                    time.sleep(2)
+                if insert_record("insurance_entries", new_entry):
+                    flash(f"✅ Application submitted successfully!")
+                    flash(f"📋 Entry ID: {entry_id} | Customer ID: {customer_id}", balloons=True)
                     st.rerun()
 
     # VIEW SAVED ENTRIES
@@ -1919,20 +3824,15 @@ def insurance_application_page(user, db_local):
 
                         if st.button("🗑️ Delete", key=f"delete_app_{entry.get('entry_id')}", use_container_width=True):
                             if st.session_state.get(delete_key, False):
-                                updated_entries = [e for e in db_local["insurance_entries"] if
-                                                   e.get("entry_id") != entry.get("entry_id")]
-                                db_local["insurance_entries"] = updated_entries
-
                                 if entry.get("aadhar_photo_path") and os.path.exists(entry.get("aadhar_photo_path")):
                                     try:
                                         os.remove(entry.get("aadhar_photo_path"))
                                     except:
                                         pass
 
-                                if save_data(db_local):
-                                    st.success(f"✅ Entry {entry.get('entry_id')} deleted!")
+                                if delete_record("insurance_entries", entry.get("entry_id")):
+                                    flash(f"✅ Entry {entry.get('entry_id')} deleted!")
                                     st.session_state[delete_key] = False
-                                    time.sleep(1)
                                     st.rerun()
                             else:
                                 st.session_state[delete_key] = True
@@ -1943,6 +3843,61 @@ def insurance_application_page(user, db_local):
 # ====================
 # INSURANCE MANAGEMENT PAGE
 # ====================
+def insurance_bulk_actions(user: Dict, pending: List[Dict]):
+    """Approve or reject many pending applications in one transaction"""
+    username = user.get("username")
+    review_gated = user.get("role") in REVIEW_GATED_ROLES
+
+    with st.expander(f"🗂️ Bulk Actions ({len(pending)} pending)"):
+        if review_gated:
+            st.caption(f"Only applications you have kept open for {REVIEW_SECONDS} seconds below are acted on.")
+        with st.form(key="insurance_bulk_form", clear_on_submit=True):
+            select_all = st.checkbox(f"All {len(pending)} pending applications in this view")
+            labels = {e.get("entry_id"): f"{e.get('entry_id')} | {e.get('applicant_name')} | {e.get('insurance_type')}"
+                      for e in pending}
+            selected = st.multiselect("Applications", list(labels), format_func=labels.get)
+            reason = st.text_area("Rejection Reason (required to reject)", placeholder="Shared by every rejected application")
+
+            col_approve, col_reject = st.columns(2)
+            with col_approve:
+                approve = st.form_submit_button("✅ Approve Selected", type="primary", use_container_width=True)
+            with col_reject:
+                reject = st.form_submit_button("❌ Reject Selected", use_container_width=True)
+
+        if not (approve or reject):
+            return
+        entry_ids = list(labels) if select_all else selected
+        if not entry_ids:
+            st.error("Select at least one application")
+            return
+        if reject and not reason.strip():
+            st.error("Rejection reason is required")
+            return
+        skipped = unreviewed(st.session_state.insurance_open_times, username, entry_ids) if review_gated else []
+        entry_ids = [entry_id for entry_id in entry_ids if entry_id not in skipped]
+        if not entry_ids:
+            st.warning(f"⏳ None of the selected applications has been reviewed yet - "
+                       f"keep each one open for {REVIEW_SECONDS} seconds first.")
+            return
+
+        if approve:
+            applied = apply_transition(user, "insurance_entries", "approve", entry_ids)
+        else:
+            applied = apply_transition(user, "insurance_entries", "reject", entry_ids,
+                                       {"rejection_reason": reason.strip()})
+        if applied is not None:
+            for entry_id in entry_ids:
+                st.session_state.insurance_open_times.pop(f"{username}_{entry_id}", None)
+            flash(f"✅ {applied} application(s) {'approved' if approve else 'rejected'}.")
+            if applied < len(entry_ids):
+                flash(f"⚠️ {len(entry_ids) - applied} application(s) skipped - their status changed in the meantime.",
+                      kind="warning")
+            if skipped:
+                flash(f"⏳ {len(skipped)} application(s) skipped - not reviewed yet: {', '.join(skipped)}",
+                      kind="warning")
+            st.rerun()
+
+
 def insurance_management_page(user, db_local):
     """Insurance management page for managers"""
     st.markdown(f'<h2 class="burgundy-header">🏥 Insurance Management</h2>', unsafe_allow_html=True)
@@ -1962,8 +3917,8 @@ def insurance_management_page(user, db_local):
 
     # ✅ RELOAD DATA FOR REAL-TIME UPDATES
     db_fresh = load_data()
-    all_entries = db_fresh.get("insurance_entries", [])
-    entries = filter_insurance_by_role(all_entries, user, db_fresh)
+    scope = scoped_pks(db_fresh, "insurance_entries", user, owner_field="staff_id")
+    entries = select_records(db_fresh, "insurance_entries", scope)
 
     if not entries:
         st.info("No insurance applications found.")
@@ -1977,11 +3932,7 @@ def insurance_management_page(user, db_local):
             f'<div class="metric-card"><div class="metric-value">{total}</div><div class="metric-label">Total</div></div>',
             unsafe_allow_html=True)
     with col2:
-        pending = len([e for e in entries if e.get("status") == "submitted" and role == "branch_manager"])
-        if role == "area_manager":
-            pending = len([e for e in entries if e.get("status") == "approved_by_branch_manager"])
-        elif role == "AGM":
-            pending = len([e for e in entries if e.get("status") == "approved_by_area_manager"])
+        pending = len([e for e in entries if can_transition("insurance_entries", "approve", role, e)])
         st.markdown(
             f'<div class="metric-card"><div class="metric-value">{pending}</div><div class="metric-label">Pending</div></div>',
             unsafe_allow_html=True)
@@ -2017,50 +3968,39 @@ def insurance_management_page(user, db_local):
     with col4:
         st.write("")
 
-    filtered = entries
-
-    if branch_filter != "All":
-        filtered = [e for e in filtered if e.get("branch") == branch_filter]
-
-    if type_filter != "All":
-        filtered = [e for e in filtered if e.get("insurance_type") == type_filter]
+    approval = transition_for("insurance_entries", "approve", role)
+    pending_status = approval.sources[0] if approval else None
+    status_value = {"Pending": pending_status, "Approved": "approved_by_agm", "Rejected": "rejected"}.get(status_filter)
 
-    if status_filter == "Pending":
-        if role == "branch_manager":
-            filtered = [e for e in filtered if e.get("status") == "submitted"]
-        elif role == "area_manager":
-            filtered = [e for e in filtered if e.get("status") == "approved_by_branch_manager"]
-        elif role == "AGM":
-            filtered = [e for e in filtered if e.get("status") == "approved_by_area_manager"]
-    elif status_filter == "Approved":
-        filtered = [e for e in filtered if e.get("status") == "approved_by_agm"]
-    elif status_filter == "Rejected":
-        filtered = [e for e in filtered if e.get("status") == "rejected"]
+    filtered = select_records(
+        db_fresh, "insurance_entries", scope,
+        index_lookup(db_fresh, "insurance_entries", "branch", [branch_filter]) if branch_filter != "All" else None,
+        index_lookup(db_fresh, "insurance_entries", "insurance_type", [type_filter]) if type_filter != "All" else None,
+        index_lookup(db_fresh, "insurance_entries", "status", [status_value]) if status_value else None,
+    )
 
     st.markdown(f"**Found {len(filtered)} applications**")
 
     if filtered:
-        excel_data = export_insurance_to_excel(filtered)
         st.download_button(
             label="📥 Download Excel",
-            data=excel_data,
+            data=deferred_export(db_fresh, "insurance_entries", filtered, export_insurance_to_excel),
+            on_click="ignore",
             file_name=f"insurance_{role}_{datetime.now().strftime('%Y%m%d')}.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            mime=XLSX_MIME
         )
 
+    pending_in_view = [e for e in filtered if pending_status and e.get("status") == pending_status]
+    if pending_in_view:
+        insurance_bulk_actions(user, pending_in_view)
+
     st.markdown('<div style="margin:2rem 0;"></div>', unsafe_allow_html=True)
 
-    for entry in filtered:
+    for entry in paginate("insurance_entries", filtered, key="insurance_pager"):
         entry_id = entry.get("entry_id")
         status = entry.get("status", "submitted")
 
-        can_approve = False
-        if role == "branch_manager" and status == "submitted":
-            can_approve = True
-        elif role == "area_manager" and status == "approved_by_branch_manager":
-            can_approve = True
-        elif role == "AGM" and status == "approved_by_area_manager":
-            can_approve = True
+        can_approve = can_transition("insurance_entries", "approve", role, entry)
 
         if status == "submitted":
             status_class = "status-submitted"
@@ -2179,51 +4119,21 @@ def insurance_management_page(user, db_local):
             if can_approve:
                 st.markdown('<div style="margin:1.5rem 0;"></div>', unsafe_allow_html=True)
 
-                if role in ["branch_manager", "area_manager"]:
-                    timer_key = f"{username}_{entry_id}"
-                    if timer_key not in st.session_state.insurance_open_times:
-                        st.session_state.insurance_open_times[timer_key] = time.time()
-
-                    elapsed = time.time() - st.session_state.insurance_open_times[timer_key]
-                    remaining = max(0, 10 - int(elapsed))
-
-                    if remaining > 0:
-                        st.markdown(
-                            f'<div class="timer-message">⏳ Please review the application carefully. Action buttons will be available in {remaining} seconds...</div>',
-                            unsafe_allow_html=True
-                        )
-                        time.sleep(1)
-                        st.rerun()
+                timer_key = f"{username}_{entry_id}"
+                review_gated = role in REVIEW_GATED_ROLES
+                if review_gated:
+                    render_review_gate(st.session_state.insurance_open_times, timer_key,
+                                       "Please review the application carefully. Action buttons will be available in")
 
                 col_approve, col_reject = st.columns(2)
 
                 with col_approve:
-                    if st.button(f"✅ Approve", key=f"approve_{entry_id}", type="primary", use_container_width=True):
-                        for i, e in enumerate(db_fresh["insurance_entries"]):
-                            if e.get("entry_id") == entry_id:
-                                if role == "branch_manager":
-                                    db_fresh["insurance_entries"][i]["status"] = "approved_by_branch_manager"
-                                    db_fresh["insurance_entries"][i]["approved_by_bm"] = username
-                                    db_fresh["insurance_entries"][i]["bm_approval_time"] = datetime.now().strftime(
-                                        "%Y-%m-%d %H:%M:%S")
-                                elif role == "area_manager":
-                                    db_fresh["insurance_entries"][i]["status"] = "approved_by_area_manager"
-                                    db_fresh["insurance_entries"][i]["approved_by_am"] = username
-                                    db_fresh["insurance_entries"][i]["am_approval_time"] = datetime.now().strftime(
-                                        "%Y-%m-%d %H:%M:%S")
-                                elif role == "AGM":
-                                    db_fresh["insurance_entries"][i]["status"] = "approved_by_agm"
-                                    db_fresh["insurance_entries"][i]["approved_by_agm"] = username
-                                    db_fresh["insurance_entries"][i]["agm_approval_time"] = datetime.now().strftime(
-                                        "%Y-%m-%d %H:%M:%S")
-                                break
-
-                        if save_data(db_fresh):
-                            timer_key = f"{username}_{entry_id}"
+                    if st.button(f"✅ Approve", key=f"approve_{entry_id}", type="primary", use_container_width=True) and (
+                            not review_gated or review_gate_passed(st.session_state.insurance_open_times, timer_key)):
+                        if apply_transition_one(user, "insurance_entries", "approve", entry_id):
                             if timer_key in st.session_state.insurance_open_times:
                                 del st.session_state.insurance_open_times[timer_key]
-                            st.success("✅ Application approved successfully!")
-                            time.sleep(1)
+                            flash("✅ Application approved successfully!")
                             st.rerun()
 
                 with col_reject:
@@ -2236,21 +4146,15 @@ def insurance_management_page(user, db_local):
 
                         col_confirm, col_cancel = st.columns(2)
                         with col_confirm:
-                            if st.button("Confirm Reject", key=f"confirm_reject_{entry_id}", type="primary"):
+                            if st.button("Confirm Reject", key=f"confirm_reject_{entry_id}", type="primary") and (
+                                    not review_gated or review_gate_passed(st.session_state.insurance_open_times, timer_key)):
                                 if reason:
-                                    for i, e in enumerate(db_fresh["insurance_entries"]):
-                                        if e.get("entry_id") == entry_id:
-                                            db_fresh["insurance_entries"][i]["status"] = "rejected"
-                                            db_fresh["insurance_entries"][i]["rejection_reason"] = reason
-                                            break
-
-                                    if save_data(db_fresh):
-                                        timer_key = f"{username}_{entry_id}"
+                                    if apply_transition_one(user, "insurance_entries", "reject", entry_id,
+                                                            {"rejection_reason": reason}):
                                         if timer_key in st.session_state.insurance_open_times:
                                             del st.session_state.insurance_open_times[timer_key]
                                         st.session_state[show_reject_key] = False
-                                        st.success("Application rejected.")
-                                        time.sleep(1)
+                                        flash("Application rejected.")
                                         st.rerun()
                                 else:
                                     st.error("Rejection reason is required")
@@ -2434,8 +4338,7 @@ def lead_entry_page(user, db_local):
             elif not location_final:
                 st.error("❌ Location is required!")
             else:
-                customer_leads = db_local.get("customer_leads", [])
-                lead_id = generate_lead_id(customer_leads)
+                lead_id = generate_lead_id()
 
                 if gps_lat and gps_lon:
                     map_url = f"https://www.google.com/maps?q={gps_lat},{gps_lon}"
@@ -2465,15 +4368,10 @@ def lead_entry_page(user, db_local):
                     "customer_id": None
                 }
 
-                customer_leads.append(new_lead)
-                db_local["customer_leads"] = customer_leads
-
-                if save_data(db_local):
-                    st.success(f"✅ Lead {lead_id} saved successfully!")
-                    st.balloons()
+                if insert_record("customer_leads", new_lead):
+                    flash(f"✅ Lead {lead_id} saved successfully!", balloons=True)
                     st.session_state.show_gps = False
                     st.session_state.gps_data = None
-                    time.sleep(1)
                     st.rerun()
 
     # VIEW SAVED LEADS
@@ -2552,14 +4450,9 @@ def lead_entry_page(user, db_local):
                         st.warning(f"⚠️ Click delete again to confirm deletion of {selected_delete_id}")
                         st.rerun()
                     else:
-                        updated_leads = [l for l in db_local["customer_leads"] if
-                                         l.get("lead_id") != selected_delete_id]
-                        db_local["customer_leads"] = updated_leads
-
-                        if save_data(db_local):
-                            st.success(f"✅ Lead {selected_delete_id} deleted!")
+                        if delete_record("customer_leads", selected_delete_id):
+                            flash(f"✅ Lead {selected_delete_id} deleted!")
                             st.session_state.delete_confirm_lead = None
-                            time.sleep(1)
                             st.rerun()
 
 
@@ -2645,7 +4538,7 @@ def lead_status_page(user, db_local):
     else:
         st.markdown("### 📋 All Active Leads")
 
-    for lead in leads_to_show:
+    for lead in paginate("customer_leads", leads_to_show, key="lead_status_pager"):
         lead_id = lead.get("lead_id")
         lead_type = lead.get("lead_type")
 
@@ -2679,6 +4572,7 @@ def lead_status_page(user, db_local):
             with col_update:
                 with st.form(key=f"update_form_{lead_id}"):
                     st.markdown("#### 🔄 Update Lead")
+                    version = seen_version(db_local, "customer_leads", lead_id, f"update_form_{lead_id}")
 
                     new_lead_type = st.selectbox("Lead Type", ["HOT", "WARM", "COOL"],
                                                  index=["HOT", "WARM", "COOL"].index(lead_type),
@@ -2687,17 +4581,13 @@ def lead_status_page(user, db_local):
                                                    key=f"desc_{lead_id}", height=100)
 
                     if st.form_submit_button("💾 Update", type="primary"):
-                        for i, l in enumerate(db_local["customer_leads"]):
-                            if l.get("lead_id") == lead_id:
-                                db_local["customer_leads"][i]["lead_type"] = new_lead_type
-                                db_local["customer_leads"][i]["description"] = new_description
-                                db_local["customer_leads"][i]["last_followup"] = datetime.now().strftime("%Y-%m-%d")
-                                db_local["customer_leads"][i]["followup_count"] = l.get("followup_count", 0) + 1
-                                break
-
-                        if save_data(db_local):
-                            st.success("✅ Lead updated successfully!")
-                            time.sleep(1)
+                        if update_record_checked("customer_leads", lead_id, {
+                            "lead_type": new_lead_type,
+                            "description": new_description,
+                            "last_followup": datetime.now().strftime("%Y-%m-%d"),
+                            "followup_count": lead.get("followup_count", 0) + 1
+                        }, version):
+                            flash("✅ Lead updated successfully!")
                             st.rerun()
 
             with col_convert:
@@ -2705,24 +4595,19 @@ def lead_status_page(user, db_local):
                 st.markdown('<div style="margin:0.5rem 0;"></div>', unsafe_allow_html=True)
 
                 with st.form(key=f"convert_form_{lead_id}"):
+                    version = seen_version(db_local, "customer_leads", lead_id, f"convert_form_{lead_id}")
                     customer_id = st.text_input("Enter Customer ID (numeric only)",
                                                 placeholder="e.g., 12345",
                                                 key=f"custid_{lead_id}")
 
                     if st.form_submit_button("🎯 Mark as Converted", type="primary"):
                         if customer_id and customer_id.isdigit():
-                            for i, l in enumerate(db_local["customer_leads"]):
-                                if l.get("lead_id") == lead_id:
-                                    db_local["customer_leads"][i]["converted"] = True
-                                    db_local["customer_leads"][i]["customer_id"] = customer_id
-                                    db_local["customer_leads"][i]["conversion_date"] = datetime.now().strftime(
-                                        "%Y-%m-%d %H:%M:%S")
-                                    break
-
-                            if save_data(db_local):
-                                st.success(f"✅ Lead {lead_id} marked as converted with Customer ID: {customer_id}")
-                                st.balloons()
-                                time.sleep(1)
+                            if update_record_checked("customer_leads", lead_id, {
+                                "converted": True,
+                                "customer_id": customer_id,
+                                "conversion_date": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                            }, version):
+                                flash(f"✅ Lead {lead_id} marked as converted with Customer ID: {customer_id}", balloons=True)
                                 st.rerun()
                         else:
                             st.error("❌ Please enter a valid numeric Customer ID")
@@ -2823,6 +4708,7 @@ def user_management_page(user, db_local):
 
         with st.expander(f"✏️ Edit: {uname}"):
             with st.form(key=f"edit_form_{uname}"):
+                version = seen_version(db_local, "users", uname, f"edit_form_{uname}")
                 col1, col2 = st.columns(2)
 
                 with col1:
@@ -2845,26 +4731,21 @@ def user_management_page(user, db_local):
 
                 with col_save:
                     if st.form_submit_button("💾 Save Changes", type="primary"):
+                        changes = {"assigned_branches": [b.strip() for b in new_branches.split(",") if b.strip()]}
                         if new_password:
-                            db_local["users"][uname]["password"] = hash_password(new_password)
-                        db_local["users"][uname]["assigned_branches"] = [b.strip() for b in new_branches.split(",") if
-                                                                         b.strip()]
+                            changes["password"] = hash_password(new_password)
 
                         if udata.get("department") == "Sales":
-                            db_local["users"][uname]["assigned_products"] = [p.strip() for p in new_products.split(",")
-                                                                             if p.strip()]
+                            changes["assigned_products"] = [p.strip() for p in new_products.split(",") if p.strip()]
 
-                        if save_data(db_local):
-                            st.success("✅ User updated!")
-                            time.sleep(1)
+                        if update_record_checked("users", uname, changes, version):
+                            flash("✅ User updated!")
                             st.rerun()
 
                 with col_delete:
                     if st.form_submit_button("🗑️ Delete User"):
-                        del db_local["users"][uname]
-                        if save_data(db_local):
-                            st.success(f"✅ User {uname} deleted!")
-                            time.sleep(1)
+                        if delete_record("users", uname):
+                            flash(f"✅ User {uname} deleted!")
                             st.rerun()
 
 # ====================
@@ -2999,7 +4880,7 @@ def create_user_page(user, db_local):
             }
             role_save = role_mapping[selected_role]
 
-        db_local["users"][username] = {
+        new_user = {
             "username": username,
             "password": hash_password(password),
             "role": role_save,
@@ -3010,11 +4891,10 @@ def create_user_page(user, db_local):
             "created_at": str(datetime.now())
         }
 
-        if save_data(db_local):
+        if insert_record("users", new_user):
             branch_text = f" with branches: {', '.join(branch_list)}" if branch_list else ""
             product_text = f" and products: {', '.join(product_list)}" if product_list else ""
-            st.success(f"✅ {selected_role} '{username}' created successfully{branch_text}{product_text}!")
-            time.sleep(1)
+            flash(f"✅ {selected_role} '{username}' created successfully{branch_text}{product_text}!")
             st.rerun()
 
 # ====================
@@ -3026,48 +4906,29 @@ def reports_page(db_local):
 
     user = st.session_state.user
     role = user.get("role")
-    username = user.get("username")
 
     # ✅ RELOAD DATA FOR REAL-TIME UPDATES
     db_fresh = load_data()
 
-    # Get all data sources
-    all_leads = db_fresh.get("leads", [])
-    customer_leads = db_fresh.get("customer_leads", [])
-    insurance_entries = db_fresh.get("insurance_entries", [])
-
     # ✅ FILTER DATA BY ROLE
-    if role == "admin":
-        filtered_leads = all_leads
-        filtered_customer_leads = customer_leads
-        filtered_insurance = insurance_entries
-    elif role == "branch_staff":
-        filtered_leads = [l for l in all_leads if l.get("submitted_by") == username]
-        filtered_customer_leads = [l for l in customer_leads if l.get("staff_name") == username]
-        filtered_insurance = [e for e in insurance_entries if e.get("staff_id") == username]
-    elif role == "branch_manager":
-        assigned_branches = user.get("assigned_branches", [])
-        filtered_leads = [l for l in all_leads if l.get("branch") in assigned_branches]
-        filtered_customer_leads = [l for l in customer_leads if l.get("branch") in assigned_branches]
-        filtered_insurance = [e for e in insurance_entries if e.get("branch") in assigned_branches]
-    elif role == "area_manager":
-        assigned_branches = user.get("assigned_branches", [])
-        filtered_leads = [l for l in all_leads if l.get("branch") in assigned_branches]
-        filtered_customer_leads = [l for l in customer_leads if l.get("branch") in assigned_branches]
-        filtered_insurance = [e for e in insurance_entries if e.get("branch") in assigned_branches]
-    elif role == "AGM":
-        ams = [u for u, d in db_fresh["users"].items()
-               if d.get("created_by") == username and d.get("role") == "area_manager"]
-        branches = []
-        for am in ams:
-            branches.extend(db_fresh["users"][am].get("assigned_branches", []))
-        filtered_leads = [l for l in all_leads if l.get("branch") in branches]
-        filtered_customer_leads = [l for l in customer_leads if l.get("branch") in branches]
-        filtered_insurance = [e for e in insurance_entries if e.get("branch") in branches]
-    else:
-        filtered_leads = []
-        filtered_customer_leads = []
-        filtered_insurance = []
+    leads_scope = scoped_pks(db_fresh, "leads", user, owner_field="submitted_by")
+    customer_leads_scope = scoped_pks(db_fresh, "customer_leads", user, owner_field="staff_name")
+    insurance_scope = scoped_pks(db_fresh, "insurance_entries", user, owner_field="staff_id")
+    filtered_leads = select_records(db_fresh, "leads", leads_scope)
+    filtered_customer_leads = select_records(db_fresh, "customer_leads", customer_leads_scope)
+    filtered_insurance = select_records(db_fresh, "insurance_entries", insurance_scope)
+
+    # Dashboard figures are rolled up from the materialized aggregates, not the raw records
+    lead_frame = aggregate_frame(db_fresh, "leads", user)
+    customer_lead_frame = aggregate_frame(db_fresh, "customer_leads", user)
+    insurance_frame = aggregate_frame(db_fresh, "insurance_entries", user)
+
+    # One long frame of (branch, staff, measure, count) feeds the staff and branch breakdowns
+    activity = pd.concat([
+        lead_frame[["branch", "staff", "count"]].assign(measure="system_leads"),
+        customer_lead_frame[["branch", "staff", "count"]].assign(measure="customer_leads"),
+        insurance_frame[["branch", "staff", "count"]].assign(measure="insurance_apps"),
+    ], ignore_index=True)
 
     # ===========================
     # SECTION 1: OVERVIEW METRICS
@@ -3077,40 +4938,38 @@ def reports_page(db_local):
     col1, col2, col3, col4, col5 = st.columns(5)
 
     with col1:
-        total_leads = len(filtered_leads)
+        total_leads = int(lead_frame["count"].sum())
         st.markdown(
             f'<div class="metric-card"><div class="metric-value">{total_leads}</div><div class="metric-label">System Leads</div></div>',
             unsafe_allow_html=True)
 
     with col2:
-        total_customer_leads = len(filtered_customer_leads)
-        active_customer_leads = len([l for l in filtered_customer_leads if not l.get("converted", False)])
+        total_customer_leads = int(customer_lead_frame["count"].sum())
+        converted = int(customer_lead_frame.loc[customer_lead_frame["converted"], "count"].sum())
+        active_customer_leads = total_customer_leads - converted
         st.markdown(
             f'<div class="metric-card"><div class="metric-value">{active_customer_leads}</div><div class="metric-label">Active Leads</div></div>',
             unsafe_allow_html=True)
 
     with col3:
-        converted = len([l for l in filtered_customer_leads if l.get("converted", False)])
         st.markdown(
             f'<div class="metric-card"><div class="metric-value">{converted}</div><div class="metric-label">Converted</div></div>',
             unsafe_allow_html=True)
 
     with col4:
-        total_insurance = len(filtered_insurance)
+        total_insurance = int(insurance_frame["count"].sum())
         st.markdown(
             f'<div class="metric-card"><div class="metric-value">{total_insurance}</div><div class="metric-label">Insurance Apps</div></div>',
             unsafe_allow_html=True)
 
     with col5:
         if role == "branch_manager":
-            staff_count = len(
-                set([l.get("submitted_by") or l.get("staff_name") for l in filtered_leads + filtered_customer_leads if
-                     l.get("submitted_by") or l.get("staff_name")]))
+            staff_count = activity.loc[activity["measure"] != "insurance_apps", "staff"].nunique()
             st.markdown(
                 f'<div class="metric-card"><div class="metric-value">{staff_count}</div><div class="metric-label">Staff Members</div></div>',
                 unsafe_allow_html=True)
         else:
-            pending = len([l for l in filtered_leads if l.get("status") == "submitted"])
+            pending = int(lead_frame.loc[lead_frame["status"] == "submitted", "count"].sum())
             st.markdown(
                 f'<div class="metric-card"><div class="metric-value">{pending}</div><div class="metric-label">Pending</div></div>',
                 unsafe_allow_html=True)
@@ -3118,8 +4977,9 @@ def reports_page(db_local):
     st.markdown('<div style="margin:2.5rem 0;"></div>', unsafe_allow_html=True)
 
     # Credits FIN Dashboard
-    credits_entries = db_fresh.get("credits_fin_entries", [])
-    total_closing_amount = sum([e.get("amount", 0) for e in credits_entries])
+    credits_frame = aggregate_frame(db_fresh, "credits_fin_entries")
+    total_closing_amount = credits_frame["amount"].sum()
+    closed_accounts = int(credits_frame["count"].sum())
 
     st.markdown("### 💰 Credits FIN Dashboard")
     col1, col2 = st.columns(2)
@@ -3129,7 +4989,7 @@ def reports_page(db_local):
             unsafe_allow_html=True)
     with col2:
         st.markdown(
-            f'<div class="metric-card"><div class="metric-value">{len(credits_entries)}</div><div class="metric-label">Closed Accounts</div></div>',
+            f'<div class="metric-card"><div class="metric-value">{closed_accounts}</div><div class="metric-label">Closed Accounts</div></div>',
             unsafe_allow_html=True)
 
     # ===========================
@@ -3138,56 +4998,22 @@ def reports_page(db_local):
     if role in ["branch_manager", "area_manager", "AGM", "admin"]:
         st.markdown("### 👥 Staff Performance Breakdown")
 
-        all_staff_data = {}
-
-        for lead in filtered_leads:
-            staff = lead.get("submitted_by", "Unknown")
-            if staff not in all_staff_data:
-                all_staff_data[staff] = {
-                    "system_leads": 0,
-                    "customer_leads": 0,
-                    "insurance_apps": 0,
-                    "converted": 0
-                }
-            all_staff_data[staff]["system_leads"] += 1
-
-        for lead in filtered_customer_leads:
-            staff = lead.get("staff_name", "Unknown")
-            if staff not in all_staff_data:
-                all_staff_data[staff] = {
-                    "system_leads": 0,
-                    "customer_leads": 0,
-                    "insurance_apps": 0,
-                    "converted": 0
-                }
-            all_staff_data[staff]["customer_leads"] += 1
-            if lead.get("converted", False):
-                all_staff_data[staff]["converted"] += 1
-
-        for entry in filtered_insurance:
-            staff = entry.get("staff_id", "Unknown")
-            if staff not in all_staff_data:
-                all_staff_data[staff] = {
-                    "system_leads": 0,
-                    "customer_leads": 0,
-                    "insurance_apps": 0,
-                    "converted": 0
-                }
-            all_staff_data[staff]["insurance_apps"] += 1
-
-        if all_staff_data:
-            staff_df_data = []
-            for staff, data in all_staff_data.items():
-                staff_df_data.append({
-                    "Staff Name": staff,
-                    "System Leads": data["system_leads"],
-                    "Customer Leads": data["customer_leads"],
-                    "Converted": data["converted"],
-                    "Insurance Apps": data["insurance_apps"],
-                    "Total Activity": data["system_leads"] + data["customer_leads"] + data["insurance_apps"]
-                })
-
-            staff_df = pd.DataFrame(staff_df_data)
+        if not activity.empty:
+            staff_table = activity.pivot_table(index="staff", columns="measure", values="count", aggfunc="sum",
+                                               fill_value=0, observed=True, sort=False)
+            staff_table = staff_table.reindex(columns=["system_leads", "customer_leads", "insurance_apps"],
+                                              fill_value=0)
+            converted_by_staff = (customer_lead_frame[customer_lead_frame["converted"]]
+                                  .groupby("staff", observed=True)["count"].sum())
+
+            staff_df = pd.DataFrame({
+                "Staff Name": staff_table.index.astype(str),
+                "System Leads": staff_table["system_leads"].to_numpy(),
+                "Customer Leads": staff_table["customer_leads"].to_numpy(),
+                "Converted": converted_by_staff.reindex(staff_table.index, fill_value=0).to_numpy(),
+                "Insurance Apps": staff_table["insurance_apps"].to_numpy(),
+                "Total Activity": staff_table.sum(axis=1).to_numpy(),
+            })
             staff_df = staff_df.sort_values("Total Activity", ascending=False)
 
             st.dataframe(staff_df, use_container_width=True, height=300, hide_index=True)
@@ -3202,23 +5028,23 @@ def reports_page(db_local):
 
         col1, col2, col3 = st.columns(3)
 
+        active_by_type = (customer_lead_frame[~customer_lead_frame["converted"]]
+                          .groupby("lead_type", observed=True, sort=False, dropna=False)["count"].sum().to_dict())
+
         with col1:
-            hot_leads = len(
-                [l for l in filtered_customer_leads if l.get("lead_type") == "HOT" and not l.get("converted", False)])
+            hot_leads = active_by_type.get("HOT", 0)
             st.markdown(
                 f'<div class="metric-card"><div class="metric-value">{hot_leads}</div><div class="metric-label">Hot Leads</div></div>',
                 unsafe_allow_html=True)
 
         with col2:
-            warm_leads = len(
-                [l for l in filtered_customer_leads if l.get("lead_type") == "WARM" and not l.get("converted", False)])
+            warm_leads = active_by_type.get("WARM", 0)
             st.markdown(
                 f'<div class="metric-card"><div class="metric-value">{warm_leads}</div><div class="metric-label">Warm Leads</div></div>',
                 unsafe_allow_html=True)
 
         with col3:
-            cool_leads = len(
-                [l for l in filtered_customer_leads if l.get("lead_type") == "COOL" and not l.get("converted", False)])
+            cool_leads = active_by_type.get("COOL", 0)
             st.markdown(
                 f'<div class="metric-card"><div class="metric-value">{cool_leads}</div><div class="metric-label">Cool Leads</div></div>',
                 unsafe_allow_html=True)
@@ -3228,31 +5054,34 @@ def reports_page(db_local):
     # ===========================
     # SECTION 4: INSURANCE STATUS OVERVIEW
     # ===========================
+    insurance_by_status = (insurance_frame.groupby("status", observed=True, sort=False, dropna=False)["count"]
+                           .sum().to_dict())
+
     if filtered_insurance:
         st.markdown("### 🏥 Insurance Applications Status")
 
         col1, col2, col3, col4 = st.columns(4)
 
         with col1:
-            ins_pending = len([e for e in filtered_insurance if e.get("status") == "submitted"])
+            ins_pending = insurance_by_status.get("submitted", 0)
             st.markdown(
                 f'<div class="metric-card"><div class="metric-value">{ins_pending}</div><div class="metric-label">Pending BM</div></div>',
                 unsafe_allow_html=True)
 
         with col2:
-            ins_bm_approved = len([e for e in filtered_insurance if e.get("status") == "approved_by_branch_manager"])
+            ins_bm_approved = insurance_by_status.get("approved_by_branch_manager", 0)
             st.markdown(
                 f'<div class="metric-card"><div class="metric-value">{ins_bm_approved}</div><div class="metric-label">BM Approved</div></div>',
                 unsafe_allow_html=True)
 
         with col3:
-            ins_am_approved = len([e for e in filtered_insurance if e.get("status") == "approved_by_area_manager"])
+            ins_am_approved = insurance_by_status.get("approved_by_area_manager", 0)
             st.markdown(
                 f'<div class="metric-card"><div class="metric-value">{ins_am_approved}</div><div class="metric-label">AM Approved</div></div>',
                 unsafe_allow_html=True)
 
         with col4:
-            ins_fully_approved = len([e for e in filtered_insurance if e.get("status") == "approved_by_agm"])
+            ins_fully_approved = insurance_by_status.get("approved_by_agm", 0)
             st.markdown(
                 f'<div class="metric-card"><div class="metric-value">{ins_fully_approved}</div><div class="metric-label">Fully Approved</div></div>',
                 unsafe_allow_html=True)
@@ -3263,75 +5092,30 @@ def reports_page(db_local):
     # SECTION 5: VISUAL CHARTS
     # ===========================
     st.markdown("### 📊 Visual Analytics")
+    chart_scope = role_scope(db_fresh, user)
 
     col1, col2 = st.columns(2)
 
     with col1:
         if filtered_leads or filtered_customer_leads or filtered_insurance:
             st.markdown("#### Branch Distribution")
-            branch_counts = {}
-
-            for l in filtered_leads:
-                branch = l.get("branch", "Unassigned")
-                branch_counts[branch] = branch_counts.get(branch, 0) + 1
-
-            for l in filtered_customer_leads:
-                branch = l.get("branch", "Unassigned")
-                branch_counts[branch] = branch_counts.get(branch, 0) + 1
-
-            for e in filtered_insurance:
-                branch = e.get("branch", "Unassigned")
-                branch_counts[branch] = branch_counts.get(branch, 0) + 1
+            branch_counts = activity.groupby("branch", observed=True, sort=False)["count"].sum().to_dict()
 
             if branch_counts:
-                fig, ax = plt.subplots(figsize=(8, 5), facecolor='white')
-                ax.set_facecolor('white')
-                bars = ax.bar(list(branch_counts.keys()), list(branch_counts.values()),
-                              color=PRIMARY_COLOR, alpha=0.85, edgecolor='white', linewidth=2)
-                ax.set_ylabel('Total Entries', fontsize=10, fontweight='600')
-                ax.set_xlabel('Branch', fontsize=10, fontweight='600')
-                ax.tick_params(axis="x", rotation=45, labelsize=9)
-                ax.tick_params(axis="y", labelsize=9)
-                ax.spines['top'].set_visible(False)
-                ax.spines['right'].set_visible(False)
-                ax.grid(axis='y', alpha=0.2)
-
-                for bar in bars:
-                    height = bar.get_height()
-                    ax.text(bar.get_x() + bar.get_width() / 2., height,
-                            f'{int(height)}',
-                            ha='center', va='bottom', fontweight='600', fontsize=9)
-
-                plt.tight_layout()
-                st.pyplot(fig)
+                st.image(render_chart("branch", branch_counts, chart_scope, _draw_branch_chart),
+                         use_container_width=True)
             else:
                 st.info("No data available for branch distribution")
 
     with col2:
         if filtered_customer_leads:
             st.markdown("#### Customer Lead Types")
-            type_counts = {}
-            for l in filtered_customer_leads:
-                if not l.get("converted", False):
-                    ltype = l.get("lead_type", "Unknown")
-                    type_counts[ltype] = type_counts.get(ltype, 0) + 1
+            type_counts = {(ltype if pd.notna(ltype) else "Unknown"): count
+                           for ltype, count in active_by_type.items()}
 
             if type_counts:
-                fig, ax = plt.subplots(figsize=(8, 5), facecolor='white')
-                ax.set_facecolor('white')
-                colors_type = ['#dc2626', '#f59e0b', '#3b82f6']
-                wedges, texts, autotexts = ax.pie(
-                    list(type_counts.values()),
-                    labels=list(type_counts.keys()),
-                    autopct='%1.1f%%',
-                    startangle=90,
-                    colors=colors_type,
-                    textprops={'fontsize': 10, 'weight': '600'}
-                )
-                for autotext in autotexts:
-                    autotext.set_color('white')
-                plt.tight_layout()
-                st.pyplot(fig)
+                st.image(render_chart("lead_type", type_counts, chart_scope, _draw_lead_type_chart),
+                         use_container_width=True)
             else:
                 st.info("No active customer leads")
         else:
@@ -3346,31 +5130,15 @@ def reports_page(db_local):
         if filtered_insurance:
             st.markdown("#### Insurance Status Breakdown")
             ins_status_counts = {}
-            for e in filtered_insurance:
-                status = e.get("status", "submitted")
+            for status, count in insurance_by_status.items():
+                status = status if pd.notna(status) else "submitted"
                 status_label = STATUS_LABELS.get(status, (status, ""))[0]
-                ins_status_counts[status_label] = ins_status_counts.get(status_label, 0) + 1
+                ins_status_counts[status_label] = ins_status_counts.get(status_label, 0) + count
 
             if ins_status_counts:
-                fig, ax = plt.subplots(figsize=(8, 5), facecolor='white')
-                ax.set_facecolor('white')
-                colors_ins = [INSURANCE_STATUS_COLORS.get(k, "#94a3b8") for k in
-                              ["submitted", "approved_by_branch_manager", "approved_by_area_manager", "approved_by_agm",
-                               "rejected"] if STATUS_LABELS.get(k, ("", ""))[0] in ins_status_counts]
-
-                ax.barh(list(ins_status_counts.keys()), list(ins_status_counts.values()),
-                        color=colors_ins, alpha=0.85, edgecolor='white', linewidth=2)
-                ax.set_xlabel('Count', fontsize=10, fontweight='600')
-                ax.tick_params(axis="both", labelsize=9)
-                ax.spines['top'].set_visible(False)
-                ax.spines['right'].set_visible(False)
-                ax.grid(axis='x', alpha=0.2)
-
-                for i, v in enumerate(ins_status_counts.values()):
-                    ax.text(v + 0.1, i, str(v), va='center', fontweight='600', fontsize=9)
-
-                plt.tight_layout()
-                st.pyplot(fig)
+                st.image(render_chart("insurance_status", ins_status_counts, chart_scope,
+                                      _draw_insurance_status_chart),
+                         use_container_width=True)
             else:
                 st.info("No insurance status data")
         else:
@@ -3379,60 +5147,21 @@ def reports_page(db_local):
     with col2:
         if role == "admin":
             st.markdown("#### Department Distribution")
-            dept_counts = {}
-            for l in all_leads:
-                dept = l.get("department", "Unknown")
-                dept_counts[dept] = dept_counts.get(dept, 0) + 1
+            dept_counts = (aggregate_frame(db_fresh, "leads")
+                           .groupby("department", observed=True, sort=False, dropna=False)["count"].sum())
+            dept_counts = {(dept if pd.notna(dept) else "Unknown"): count for dept, count in dept_counts.items()}
 
             if dept_counts:
-                fig, ax = plt.subplots(figsize=(8, 5), facecolor='white')
-                ax.set_facecolor('white')
-                bars = ax.barh(list(dept_counts.keys()), list(dept_counts.values()),
-                               color=SECONDARY_COLOR, alpha=0.85, edgecolor='white', linewidth=2)
-                ax.set_xlabel('Number of Leads', fontsize=10, fontweight='600')
-                ax.tick_params(axis="both", labelsize=9)
-                ax.spines['top'].set_visible(False)
-                ax.spines['right'].set_visible(False)
-                ax.grid(axis='x', alpha=0.2)
-
-                for i, v in enumerate(dept_counts.values()):
-                    ax.text(v + 0.1, i, str(v), va='center', fontweight='600', fontsize=9)
-
-                plt.tight_layout()
-                st.pyplot(fig)
+                st.image(render_chart("department", dept_counts, chart_scope, _draw_department_chart),
+                         use_container_width=True)
             else:
                 st.info("No department data")
         else:
             st.markdown("#### Lead Conversion Rate")
             if total_customer_leads > 0:
-                conversion_rate = (converted / total_customer_leads) * 100
-
-                fig, ax = plt.subplots(figsize=(8, 5), facecolor='white')
-                ax.set_facecolor('white')
-
-                categories = ['Converted', 'Active']
-                values = [converted, active_customer_leads]
-                colors_conv = ['#16a34a', '#f59e0b']
-
-                bars = ax.bar(categories, values, color=colors_conv, alpha=0.85, edgecolor='white', linewidth=2)
-                ax.set_ylabel('Count', fontsize=10, fontweight='600')
-                ax.tick_params(axis="both", labelsize=9)
-                ax.spines['top'].set_visible(False)
-                ax.spines['right'].set_visible(False)
-                ax.grid(axis='y', alpha=0.2)
-
-                for bar in bars:
-                    height = bar.get_height()
-                    ax.text(bar.get_x() + bar.get_width() / 2., height,
-                            f'{int(height)}',
-                            ha='center', va='bottom', fontweight='600', fontsize=9)
-
-                ax.text(0.5, max(values) * 0.9, f'Conversion Rate: {conversion_rate:.1f}%',
-                        ha='center', fontsize=11, fontweight='700',
-                        bbox=dict(boxstyle='round', facecolor='white', edgecolor=PRIMARY_COLOR, linewidth=2))
-
-                plt.tight_layout()
-                st.pyplot(fig)
+                conversion_counts = {'Converted': converted, 'Active': active_customer_leads}
+                st.image(render_chart("conversion", conversion_counts, chart_scope, _draw_conversion_chart),
+                         use_container_width=True)
             else:
                 st.info("No customer leads data")
 
@@ -3482,7 +5211,7 @@ def reports_page(db_local):
 
     if recent_activities[:10]:
         activity_df = pd.DataFrame(recent_activities[:10])
-        activity_df["Timestamp"] = pd.to_datetime(activity_df["Timestamp"]).dt.strftime("%Y-%m-%d %H:%M")
+        activity_df["Timestamp"] = activity_df["Timestamp"].str[:16]  # stored as "%Y-%m-%d %H:%M:%S"
         st.dataframe(activity_df, use_container_width=True, height=400, hide_index=True)
     else:
         st.info("No recent activities")
@@ -3502,13 +5231,17 @@ def reports_page(db_local):
 
     st.markdown('<div style="margin:1.5rem 0;"></div>', unsafe_allow_html=True)
 
-    # Create tabs for each data type
-    tab1, tab2, tab3 = st.tabs(["📋 System Leads", "📝 Customer Leads", "🏥 Insurance Applications"])
+    # One report at a time - st.tabs would run every tab body on each rerun
+    report_view = st.radio("Report", ["📋 System Leads", "📝 Customer Leads", "🏥 Insurance Applications",
+                                      "📚 All Reports"],
+                           horizontal=True, label_visibility="collapsed", key="report_download_view")
+    as_csv = st.radio("Format", ["Excel", "CSV"], horizontal=True, key="report_download_format") == "CSV"
+    file_ext, file_mime = ("csv", "text/csv") if as_csv else ("xlsx", XLSX_MIME)
 
     # ===========================
-    # TAB 1: SYSTEM LEADS FILTERS
+    # REPORT 1: SYSTEM LEADS FILTERS
     # ===========================
-    with tab1:
+    if report_view == "📋 System Leads":
         st.markdown("#### Filter System Leads")
 
         col1, col2, col3, col4 = st.columns(4)
@@ -3550,8 +5283,9 @@ def reports_page(db_local):
 
         st.markdown('<div style="margin:1.5rem 0;"></div>', unsafe_allow_html=True)
 
-        # Apply filters
-        sys_filtered = filtered_leads
+        # Apply filters - date range first, by binary search over the sorted timestamps
+        sys_filtered = select_records(db_fresh, "leads", leads_scope,
+                                      day_range_lookup(db_fresh, "leads", sys_from_date, sys_to_date))
 
         if sys_branch_filter != "All":
             sys_filtered = [l for l in sys_filtered if l.get("branch") == sys_branch_filter]
@@ -3572,32 +5306,30 @@ def reports_page(db_local):
         if sys_staff_filter != "All":
             sys_filtered = [l for l in sys_filtered if l.get("submitted_by") == sys_staff_filter]
 
-        # Date filter
-        sys_filtered = [l for l in sys_filtered if
-                        sys_from_date <= datetime.strptime(l.get("timestamp", "2000-01-01 00:00:00"),
-                                                           "%Y-%m-%d %H:%M:%S").date() <= sys_to_date]
-
         # Show count
         st.markdown(f"**📊 Filtered Results: {len(sys_filtered)} records**")
 
-        # Download button
+        # Download button - the file is built only when it is clicked
         if sys_filtered:
-            excel_sys = export_to_excel(sys_filtered)
             st.download_button(
                 label=f"📥 Download System Leads ({len(sys_filtered)} records)",
-                data=excel_sys,
-                file_name=f"system_leads_filtered_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                data=deferred_export(db_fresh, "leads", sys_filtered, export_to_csv if as_csv else export_to_excel),
+                on_click="ignore",
+                file_name=f"system_leads_filtered_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{file_ext}",
+                mime=file_mime,
                 use_container_width=True,
                 type="primary"
             )
+            background_export_button(user, "leads", sys_filtered, file_ext, {
+                "Branch": sys_branch_filter, "Department": sys_dept_filter, "Status": sys_status_filter,
+                "Staff": sys_staff_filter, "From": str(sys_from_date), "To": str(sys_to_date)}, key="sys_export_job")
         else:
             st.warning("No data to download with current filters")
 
     # ===========================
-    # TAB 2: CUSTOMER LEADS FILTERS
+    # REPORT 2: CUSTOMER LEADS FILTERS
     # ===========================
-    with tab2:
+    elif report_view == "📝 Customer Leads":
         st.markdown("#### Filter Customer Leads")
 
         col1, col2, col3, col4 = st.columns(4)
@@ -3638,7 +5370,8 @@ def reports_page(db_local):
         st.markdown('<div style="margin:1.5rem 0;"></div>', unsafe_allow_html=True)
 
         # Apply filters
-        cust_filtered = filtered_customer_leads
+        cust_filtered = select_records(db_fresh, "customer_leads", customer_leads_scope,
+                                       day_range_lookup(db_fresh, "customer_leads", cust_from_date, cust_to_date))
 
         if cust_branch_filter != "All":
             cust_filtered = [l for l in cust_filtered if l.get("branch") == cust_branch_filter]
@@ -3654,32 +5387,31 @@ def reports_page(db_local):
         if cust_staff_filter != "All":
             cust_filtered = [l for l in cust_filtered if l.get("staff_name") == cust_staff_filter]
 
-        # Date filter
-        cust_filtered = [l for l in cust_filtered if
-                         cust_from_date <= datetime.strptime(l.get("timestamp", "2000-01-01 00:00:00"),
-                                                             "%Y-%m-%d %H:%M:%S").date() <= cust_to_date]
-
         # Show count
         st.markdown(f"**📊 Filtered Results: {len(cust_filtered)} records**")
 
-        # Download button
+        # Download button - the file is built only when it is clicked
         if cust_filtered:
-            excel_cust = export_to_excel(cust_filtered)
             st.download_button(
                 label=f"📥 Download Customer Leads ({len(cust_filtered)} records)",
-                data=excel_cust,
-                file_name=f"customer_leads_filtered_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                data=deferred_export(db_fresh, "customer_leads", cust_filtered,
+                                     export_to_csv if as_csv else export_to_excel),
+                on_click="ignore",
+                file_name=f"customer_leads_filtered_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{file_ext}",
+                mime=file_mime,
                 use_container_width=True,
                 type="primary"
             )
+            background_export_button(user, "customer_leads", cust_filtered, file_ext, {
+                "Branch": cust_branch_filter, "Lead Type": cust_type_filter, "Status": cust_status_filter,
+                "Staff": cust_staff_filter, "From": str(cust_from_date), "To": str(cust_to_date)}, key="cust_export_job")
         else:
             st.warning("No data to download with current filters")
 
     # ===========================
-    # TAB 3: INSURANCE FILTERS
+    # REPORT 3: INSURANCE FILTERS
     # ===========================
-    with tab3:
+    elif report_view == "🏥 Insurance Applications":
         st.markdown("#### Filter Insurance Applications")
 
         col1, col2, col3, col4 = st.columns(4)
@@ -3725,7 +5457,8 @@ def reports_page(db_local):
         st.markdown('<div style="margin:1.5rem 0;"></div>', unsafe_allow_html=True)
 
         # Apply filters
-        ins_filtered = filtered_insurance
+        ins_filtered = select_records(db_fresh, "insurance_entries", insurance_scope,
+                                      day_range_lookup(db_fresh, "insurance_entries", ins_from_date, ins_to_date))
 
         if ins_branch_filter != "All":
             ins_filtered = [e for e in ins_filtered if e.get("branch") == ins_branch_filter]
@@ -3750,28 +5483,48 @@ def reports_page(db_local):
         if ins_customer_id:
             ins_filtered = [e for e in ins_filtered if e.get("customer_id", "").lower() == ins_customer_id.lower()]
 
-        # Date filter
-        ins_filtered = [e for e in ins_filtered if
-                        ins_from_date <= datetime.strptime(e.get("timestamp", "2000-01-01 00:00:00"),
-                                                           "%Y-%m-%d %H:%M:%S").date() <= ins_to_date]
-
         # Show count
         st.markdown(f"**📊 Filtered Results: {len(ins_filtered)} records**")
 
-        # Download button
+        # Download button - the file is built only when it is clicked
         if ins_filtered:
-            excel_ins = export_insurance_to_excel(ins_filtered)
             st.download_button(
                 label=f"📥 Download Insurance Applications ({len(ins_filtered)} records)",
-                data=excel_ins,
-                file_name=f"insurance_filtered_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                data=deferred_export(db_fresh, "insurance_entries", ins_filtered,
+                                     export_insurance_to_csv if as_csv else export_insurance_to_excel),
+                on_click="ignore",
+                file_name=f"insurance_filtered_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{file_ext}",
+                mime=file_mime,
                 use_container_width=True,
                 type="primary"
             )
+            background_export_button(user, "insurance_entries", ins_filtered, file_ext, {
+                "Branch": ins_branch_filter, "Insurance Type": ins_type_filter, "Status": ins_status_filter,
+                "Staff": ins_staff_filter, "From": str(ins_from_date), "To": str(ins_to_date),
+                "Customer ID": ins_customer_id}, key="ins_export_job")
         else:
             st.warning("No data to download with current filters")
 
+    # ===========================
+    # REPORT 4: CONSOLIDATED WORKBOOK
+    # ===========================
+    else:
+        st.markdown("#### All Reports in One Workbook")
+        st.caption("Summary, System Leads, Customer Leads, Insurance, Reliant Best, Closed Accounts and Bids - "
+                   "everything you can see, as one Excel file")
+        st.download_button(
+            label="📥 Download Consolidated Workbook",
+            data=deferred_consolidated_export(db_fresh, user),
+            on_click="ignore",
+            file_name=f"all_reports_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
+            mime=XLSX_MIME,
+            use_container_width=True,
+            type="primary"
+        )
+        background_export_button(user, CONSOLIDATED, None, "xlsx", {}, key="all_export_job")
+
+    export_jobs_panel(user)
+
 
 # ====================
 # CUSTOMER INQUIRY PAGE
@@ -3813,7 +5566,10 @@ def customer_inquiry_page(user, db_local):
         default_to = date.today()
         to_date = st.date_input("📅 To Date", value=default_to, key="to_date")
 
-    filtered = leads
+    if from_date and to_date:
+        filtered = select_records(db_fresh, "leads", day_range_lookup(db_fresh, "leads", from_date, to_date))
+    else:
+        filtered = leads
 
     if branch_filter != "All":
         filtered = [l for l in filtered if l.get("branch") == branch_filter]
@@ -3826,22 +5582,17 @@ def customer_inquiry_page(user, db_local):
     elif status_filter == "Approved":
         filtered = [l for l in filtered if "approved" in l.get("status", "")]
 
-    if from_date and to_date:
-        filtered = [l for l in filtered if
-                    from_date <= datetime.strptime(l.get("timestamp", "2000-01-01 00:00:00"),
-                                                   "%Y-%m-%d %H:%M:%S").date() <= to_date]
-
     st.markdown(
         f'<p style="margin:1.25rem 0;">Found <strong>{len(filtered)}</strong> records between <strong>{from_date}</strong> and <strong>{to_date}</strong></p>',
         unsafe_allow_html=True)
 
     if filtered:
-        excel_data = export_to_excel(filtered)
         st.download_button(
             label="📥 Export to Excel",
-            data=excel_data,
+            data=deferred_export(db_fresh, "leads", filtered, export_to_excel),
+            on_click="ignore",
             file_name=f"inquiry_{from_date}_to_{to_date}.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            mime=XLSX_MIME
         )
 
         st.markdown('<div style="margin:1rem 0;"></div>', unsafe_allow_html=True)
@@ -3866,31 +5617,68 @@ def customer_inquiry_page(user, db_local):
 # ====================
 # ACTIVITIES PAGE
 # ====================
+def _toggle_queued_lead(cid: str):
+    st.session_state.lead_queue_selected ^= {cid}
+
+
+def lead_approval_queue(user: Dict, queue: List[Dict]):
+    """Pending leads a page at a time, with selected ones approved in one batched write.
+
+    Selections are kept in session state rather than in the checkboxes, which
+    Streamlit forgets once their page is no longer shown. Showing a lead on a
+    queue page starts its review clock, and only leads whose review time has
+    run are approved.
+    """
+    username = user.get("username")
+    open_times = st.session_state.lead_open_times
+    chosen = st.session_state.setdefault("lead_queue_selected", set())
+
+    with st.expander(f"🗂️ Approval Queue ({len(queue)} pending)"):
+        st.caption(f"Leads are approved once they have been on screen for {REVIEW_SECONDS} seconds.")
+        page = paginate("leads", queue, key="lead_queue_pager")
+        select_all = st.checkbox(f"All {len(page)} leads on this page", key="lead_queue_all")
+        for l in page:
+            cid = l.get("customer_id")
+            review_time_left(open_times, f"{username}_{cid}")
+            st.checkbox(f"{cid} | {l.get('customer_name', 'N/A')} | {l.get('branch')} | {l.get('staff_name')}",
+                        value=cid in chosen, key=f"lead_queue_{cid}", on_change=_toggle_queued_lead, args=(cid,))
+
+        page_ids = [l.get("customer_id") for l in page]
+        selected = page_ids if select_all else [l.get("customer_id") for l in queue if l.get("customer_id") in chosen]
+        if st.button(f"✅ Approve Selected ({len(selected)})", key="lead_queue_approve", type="primary",
+                     disabled=not selected):
+            skipped = unreviewed(open_times, username, selected)
+            selected = [cid for cid in selected if cid not in skipped]
+            if not selected:
+                st.warning(f"⏳ Please keep reviewing - approval unlocks {REVIEW_SECONDS} seconds after "
+                           f"the leads are shown.")
+                return
+            updated = apply_transition(user, "leads", "approve", selected)
+            if updated is not None:
+                for cid in selected:
+                    open_times.pop(f"{username}_{cid}", None)
+                chosen.difference_update(selected)
+                st.session_state.pop("lead_queue_all", None)
+                flash(f"✅ {updated} lead(s) approved.")
+                if updated < len(selected):
+                    flash(f"⚠️ {len(selected) - updated} lead(s) skipped - their status changed in the meantime.",
+                          kind="warning")
+                if skipped:
+                    flash(f"⏳ {len(skipped)} lead(s) skipped - not reviewed yet: {', '.join(skipped)}",
+                          kind="warning")
+                st.rerun()
+
+
 def activities_page(user, db_local):
     """Activities tracking page with approval workflow"""
     st.markdown(f'<h2 class="burgundy-header">📋 Activities</h2>', unsafe_allow_html=True)
 
     # ✅ RELOAD DATA FOR REAL-TIME UPDATES
     db_fresh = load_data()
-    leads = db_fresh.get("leads", [])
     role = user.get("role")
     username = user.get("username")
 
-    if role == "branch_staff":
-        my_leads = [l for l in leads if l.get("submitted_by") == username]
-    elif role == "branch_manager":
-        my_leads = [l for l in leads if l.get("branch") in user.get("assigned_branches", [])]
-    elif role == "area_manager":
-        my_leads = [l for l in leads if l.get("branch") in user.get("assigned_branches", [])]
-    elif role == "AGM":
-        ams = [u for u, d in db_fresh["users"].items() if
-               d.get("created_by") == username and d.get("role") == "area_manager"]
-        branches = []
-        for am in ams:
-            branches.extend(db_fresh["users"][am].get("assigned_branches", []))
-        my_leads = [l for l in leads if l.get("branch") in branches]
-    else:
-        my_leads = leads
+    my_leads = scoped_records(db_fresh, "leads", user, owner_field="submitted_by")
 
     col1, col2, col3 = st.columns(3)
     with col1:
@@ -3911,17 +5699,21 @@ def activities_page(user, db_local):
     st.markdown('<div style="margin:1.25rem 0;"></div>', unsafe_allow_html=True)
 
     if my_leads:
-        excel_data = export_to_excel(my_leads)
         st.download_button(
             label="📥 Download Excel",
-            data=excel_data,
+            data=deferred_export(db_fresh, "leads", my_leads, export_to_excel),
+            on_click="ignore",
             file_name=f"activities_{username}_{datetime.now().strftime('%Y%m%d')}.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            mime=XLSX_MIME
         )
 
+    queue = [l for l in my_leads if l.get("department") == "Insurance" and can_transition("leads", "approve", role, l)]
+    if queue:
+        lead_approval_queue(user, queue)
+
     st.markdown('<div style="margin:1.25rem 0;"></div>', unsafe_allow_html=True)
 
-    for idx, l in enumerate(my_leads[:20]):
+    for idx, l in enumerate(paginate("leads", my_leads, key="activities_pager")):
         cid = l.get("customer_id", f"IDX-{idx}")
         status_label, status_color = STATUS_LABELS.get(l.get("status", ""), ("Unknown", "#94a3b8"))
 
@@ -3939,59 +5731,19 @@ def activities_page(user, db_local):
                     unsafe_allow_html=True)
 
             if l.get("department") == "Insurance":
-                current_status = l.get("status", "")
-
                 lead_key = f"{username}_{cid}"
-                if lead_key not in st.session_state.lead_open_times:
-                    st.session_state.lead_open_times[lead_key] = time.time()
-
-                elapsed = time.time() - st.session_state.lead_open_times[lead_key]
-                remaining = max(0, 10 - int(elapsed))
+                open_times = st.session_state.lead_open_times
 
                 st.markdown('<div style="margin:1rem 0;"></div>', unsafe_allow_html=True)
 
-                if remaining > 0:
-                    st.markdown(
-                        f'<div class="timer-message">⏳ Please review the details. Approval available in {remaining} seconds...</div>',
-                        unsafe_allow_html=True
-                    )
-                    time.sleep(1)
-                    st.rerun()
-                else:
-                    if role == "branch_manager" and current_status == "submitted":
-                        if st.button("✅ Approve (Branch Manager)", key=f"bm_{cid}", type="primary"):
-                            data = load_data()
-                            for lead in data["leads"]:
-                                if lead.get("customer_id") == cid:
-                                    lead["status"] = "approved_by_branch_manager"
-                                    break
-                            save_data(data)
-                            if lead_key in st.session_state.lead_open_times:
-                                del st.session_state.lead_open_times[lead_key]
-                            st.rerun()
-
-                    elif role == "area_manager" and current_status == "approved_by_branch_manager":
-                        if st.button("✅ Approve (Area Manager)", key=f"am_{cid}", type="primary"):
-                            data = load_data()
-                            for lead in data["leads"]:
-                                if lead.get("customer_id") == cid:
-                                    lead["status"] = "approved_by_area_manager"
-                                    break
-                            save_data(data)
-                            if lead_key in st.session_state.lead_open_times:
-                                del st.session_state.lead_open_times[lead_key]
-                            st.rerun()
+                if can_transition("leads", "approve", role, l):
+                    render_review_gate(open_times, lead_key, "Please review the details. Approval available in")
 
-                    elif role == "AGM" and current_status == "approved_by_area_manager":
-                        if st.button("✅ Approve (AGM)", key=f"agm_{cid}", type="primary"):
-                            data = load_data()
-                            for lead in data["leads"]:
-                                if lead.get("customer_id") == cid:
-                                    lead["status"] = "approved_by_agm"
-                                    break
-                            save_data(data)
-                            if lead_key in st.session_state.lead_open_times:
-                                del st.session_state.lead_open_times[lead_key]
+                    approver = {"branch_manager": "Branch Manager", "area_manager": "Area Manager"}.get(role, role)
+                    if st.button(f"✅ Approve ({approver})", key=f"approve_lead_{cid}", type="primary") and \
+                            review_gate_passed(open_times, lead_key):
+                        if apply_transition_one(user, "leads", "approve", cid):
+                            open_times.pop(lead_key, None)
                             st.rerun()
 
 
@@ -4023,24 +5775,44 @@ def settings_page(user, db_local):
                     os.remove(curr_img)
                 except:
                     pass
-                db_local["dashboard"]["image_path"] = None
-                save_data(db_local)
+                set_value("dashboard", dict(db_local["dashboard"], image_path=None))
                 st.rerun()
 
     st.markdown('<div style="margin:1.25rem 0;"></div>', unsafe_allow_html=True)
 
     if st.button("💾 Update Settings", use_container_width=True, type="primary"):
-        db_local["dashboard"]["text"] = text
+        dashboard_settings = dict(db_local["dashboard"], text=text)
         if img:
             path = os.path.join(UPLOAD_DIR, f"dash_{int(datetime.now().timestamp())}.jpg")
-            with open(path, "wb") as f:
-                f.write(img.getbuffer())
-            db_local["dashboard"]["image_path"] = path
-        if save_data(db_local):
-            st.success("✅ Settings updated!")
-            time.sleep(1)
+            atomic_write(path, img.getbuffer())
+            dashboard_settings["image_path"] = path
+        if set_value("dashboard", dashboard_settings):
+            flash("✅ Settings updated!")
             st.rerun()
 
+    cache_stats = load_cache_stats()
+    st.caption(f"Data cache: {cache_stats['hits']} hits / {cache_stats['refreshes']} incremental refreshes / "
+               f"{cache_stats['misses']} full reloads since server start")
+    chart_stats = chart_cache_stats()
+    st.caption(f"Chart cache: {chart_stats['hits']} hits / {chart_stats['misses']} renders / "
+               f"{chart_stats['entries']} charts in {chart_stats['bytes'] / 1024:.0f} KB")
+    export_stats = export_cache_stats()
+    st.caption(f"Export cache: {export_stats['hits']} hits / {export_stats['misses']} builds / "
+               f"{export_stats['entries']} files in {export_stats['bytes'] / 1024:.0f} KB")
+
+    st.markdown("### 📦 Analytics Snapshot")
+    status = analytics_snapshot_status()
+    if status:
+        rows = sum(entry["rows"] for entry in status["collections"].values())
+        st.caption(f"{rows} records as of {status['refreshed_at']} in {ANALYTICS_DIR} - "
+                   f"read with pd.read_parquet(\"{ANALYTICS_DIR}/<collection>\")")
+    else:
+        st.caption("No snapshot yet")
+    if st.button("🔄 Refresh Analytics Snapshot", use_container_width=True):
+        with st.spinner("Writing Parquet snapshot..."):
+            rewritten = refresh_analytics_snapshot()
+        st.success(f"✅ Snapshot updated - {sum(rewritten.values())} partitions rewritten")
+
 
 # ====================
 # MAIN DASHBOARD - COMPLETE FIXED VERSION
@@ -4169,6 +5941,10 @@ def dashboard():
         </div>
     ''', unsafe_allow_html=True)
 
+    show_flash_messages()
+    if role == "admin" and db_local.get("legacy_import_repairs"):
+        show_legacy_import_repairs(db_local["legacy_import_repairs"])
+
     # ===========================
     # PAGE ROUTING
     # ===========================
@@ -4322,7 +6098,7 @@ def fin_close_page(user, db_local):
                 st.error("❌ All fields are required!")
             else:
                 new_entry = {
-                    "entry_id": generate_credits_fin_entry_id(db_local.get("credits_fin_entries", [])),
+                    "entry_id": generate_credits_fin_entry_id(),
                     "branch": branch,
                     "department": department,
                     "user_name": user_name,
@@ -4335,8 +6111,7 @@ def fin_close_page(user, db_local):
                     "booked": False,
                     "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
                 }
-                db_local["credits_fin_entries"].append(new_entry)
-                save_data(db_local)
+                insert_record("credits_fin_entries", new_entry)
                 st.success("✅ FIN Closed successfully!")
                 st.balloons()
                 st.stop()
@@ -4375,7 +6150,7 @@ def place_bid_page(user, db_local):
         st.info("✅ No slot available.")
         return
 
-    for entry in visible_entries:
+    for entry in paginate("credits_fin_entries", visible_entries, key="place_bid_pager"):
         with st.expander(f"{entry.get('entry_id')} | {entry.get('name')} | ₹{entry.get('amount'):,}"):
             st.markdown(f"**Branch:** {entry.get('branch')}")
             st.markdown(f"**Customer Name:** {entry.get('name')}")
@@ -4386,7 +6161,7 @@ def place_bid_page(user, db_local):
             if st.button("📝 Place Bid", key=f"bid_{entry.get('entry_id')}", use_container_width=True, type="primary"):
                 try:
                     new_bid = {
-                        "bid_id": generate_bid_id(db_fresh.get("bids", [])),
+                        "bid_id": generate_bid_id(),
                         "entry_id": entry.get("entry_id"),
                         "bidder": user.get("username"),
                         "branch": entry.get("branch"),
@@ -4394,9 +6169,8 @@ def place_bid_page(user, db_local):
                         "status": "PLACED",
                         "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
                     }
-                    db_fresh["bids"].append(new_bid)
-                    save_data(db_fresh)
-                    st.success(f"✅ Bid placed successfully for {entry.get('entry_id')}!")
+                    insert_record("bids", new_bid)
+                    flash(f"✅ Bid placed successfully for {entry.get('entry_id')}!")
                     st.rerun()
                 except Exception as e:
                     st.error(f"❌ Error placing bid: {e}")
@@ -4423,24 +6197,17 @@ def manage_credits_fin_main(user):
             st.rerun()
 
 
-def export_credits_fin_to_excel(entries):
+CREDITS_FIN_EXPORT_ORDER = [
+    "entry_id", "name", "customer_id", "branch", "department",
+    "scheme", "amount", "booked", "narration", "timestamp", "user_name", "maturity"
+]
+
+
+def export_credits_fin_to_excel(entries, fields):
     """Convert list of dicts (entries) to Excel and return as BytesIO"""
     if not entries:
         return None
-
-    df = pd.DataFrame(entries)
-
-    columns_order = [
-        "entry_id", "name", "customer_id", "branch", "department",
-        "scheme", "amount", "booked", "narration", "timestamp", "user_name", "maturity"
-    ]
-    df = df[[c for c in columns_order if c in df.columns]]
-
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine="openpyxl") as writer:
-        df.to_excel(writer, index=False, sheet_name="Closed Accounts")
-    output.seek(0)
-    return output
+    return write_xlsx(record_columns(fields, CREDITS_FIN_EXPORT_ORDER), entries, "Closed Accounts")
 
 
 def closed_accounts_page(user, db_local):
@@ -4452,7 +6219,8 @@ def closed_accounts_page(user, db_local):
         st.rerun()
 
     db_fresh = load_data()
-    entries = filter_credits_fin_by_role(db_fresh.get("credits_fin_entries", []), user)
+    scope = credits_fin_scope(db_fresh, user)
+    entries = select_records(db_fresh, "credits_fin_entries", scope)
 
     st.markdown("### 🔍 Filters")
     col1, col2, col3 = st.columns(3)
@@ -4469,31 +6237,32 @@ def closed_accounts_page(user, db_local):
         status_options = ["All", "Booked", "Not Booked"]
         status_filter = st.selectbox("Status", status_options, key="closed_status_filter")
 
-    filtered_entries = entries
-    if branch_filter != "All":
-        filtered_entries = [e for e in filtered_entries if e.get("branch") == branch_filter]
-    if scheme_filter != "All":
-        filtered_entries = [e for e in filtered_entries if e.get("scheme") == scheme_filter]
-    if status_filter == "Booked":
-        filtered_entries = [e for e in filtered_entries if e.get("booked", False)]
-    elif status_filter == "Not Booked":
-        filtered_entries = [e for e in filtered_entries if not e.get("booked", False)]
+    booked_values = {"Booked": [True], "Not Booked": [False, None]}.get(status_filter)
+    filtered_entries = select_records(
+        db_fresh, "credits_fin_entries", scope,
+        index_lookup(db_fresh, "credits_fin_entries", "branch", [branch_filter]) if branch_filter != "All" else None,
+        index_lookup(db_fresh, "credits_fin_entries", "scheme", [scheme_filter]) if scheme_filter != "All" else None,
+        index_lookup(db_fresh, "credits_fin_entries", "booked", booked_values) if booked_values else None,
+    )
 
     if filtered_entries:
-        excel_data = export_credits_fin_to_excel(filtered_entries)
         st.download_button(
             label="📥 Download Closed Accounts Excel",
-            data=excel_data,
+            data=deferred_export(db_fresh, "credits_fin_entries", filtered_entries, export_credits_fin_to_excel),
+            on_click="ignore",
             file_name=f"closed_accounts_filtered_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            mime=XLSX_MIME,
             use_container_width=True
         )
+        background_export_button(user, "credits_fin_entries", filtered_entries, "xlsx", {
+            "Branch": branch_filter, "Scheme": scheme_filter, "Status": status_filter}, key="closed_export_job")
+    export_jobs_panel(user)
 
     if not filtered_entries:
         st.info("No closed accounts match the filters.")
         return
 
-    for entry in filtered_entries:
+    for entry in paginate("credits_fin_entries", filtered_entries, key="closed_accounts_pager"):
         booked_status = " (BOOKED)" if entry.get("booked", False) else ""
 
         with st.expander(f"{entry.get('entry_id')} | {entry.get('name')} | ₹{entry.get('amount'):,}{booked_status}"):
@@ -4521,54 +6290,40 @@ def closed_accounts_page(user, db_local):
                         st.success("✅ Already BOOKED")
                     else:
                         if st.button(f"🔒 BOOKED", key=f"manual_book_{entry.get('entry_id')}"):
-                            try:
-                                db_fresh = load_data()
-                                for e in db_fresh["credits_fin_entries"]:
-                                    if e.get("entry_id") == entry.get("entry_id"):
-                                        e["booked"] = True
-                                for bid in db_fresh.get("bids", []):
-                                    if bid.get("entry_id") == entry.get("entry_id"):
-                                        bid["status"] = "BOOKED"
-                                save_data(db_fresh)
-                                st.success(f"✅ Account {entry['entry_id']} marked as BOOKED!")
+                            if apply_transition_one(user, "credits_fin_entries", "book", entry.get("entry_id")):
+                                flash(f"✅ Account {entry['entry_id']} marked as BOOKED!")
                                 st.rerun()
-                            except Exception as e:
-                                st.error(f"❌ Failed to update booking: {e}")
 
                 # ✅ NEW FEATURE: REJECT AFTER BOOKED (AGM)
                 with col_reject:
                     if entry.get("booked", False):
                         if st.button("❌ Reject After Booked", key=f"reject_booked_{entry.get('entry_id')}"):
-                            try:
-                                db_fresh = load_data()
-                                for e in db_fresh["credits_fin_entries"]:
-                                    if e.get("entry_id") == entry.get("entry_id"):
-                                        e["booked"] = False  # Unbook
-                                for bid in db_fresh.get("bids", []):
-                                    if bid.get("entry_id") == entry.get("entry_id"):
-                                        bid["status"] = "PLACED"  # Revert bid status
-                                save_data(db_fresh)
-                                st.warning(f"⚠️ Booking rejected for Entry {entry.get('entry_id')} — returned to placed bids.")
+                            # Unbook and return its bids to placed
+                            if apply_transition_one(user, "credits_fin_entries", "unbook", entry.get("entry_id")):
+                                flash(f"⚠️ Booking rejected for Entry {entry.get('entry_id')} — returned to placed bids.",
+                                      kind="warning")
                                 st.rerun()
-                            except Exception as e:
-                                st.error(f"❌ Error rejecting booking: {e}")
 
                 with col_delete:
                     if st.button(f"🗑️ Delete Entry", key=f"delete_{entry.get('entry_id')}"):
                         if st.session_state.get(delete_key, False):
                             try:
-                                db_fresh = load_data()
-                                db_fresh["credits_fin_entries"] = [
-                                    e for e in db_fresh["credits_fin_entries"] if e.get("entry_id") != entry.get("entry_id")
-                                ]
-                                db_fresh["bids"] = [
-                                    b for b in db_fresh["bids"] if b.get("entry_id") != entry.get("entry_id")
-                                ]
-                                save_data(db_fresh)
-                                st.success(f"✅ Entry {entry.get('entry_id')} deleted successfully.")
-                                st.session_state[delete_key] = False
-                                time.sleep(1)
-                                st.rerun()
+                                deletes = [("credits_fin_entries", entry.get("entry_id"))]
+                                deletes += [("bids", b.get("bid_id")) for b in db_fresh.get("bids", [])
+                                            if b.get("entry_id") == entry.get("entry_id")]
+                                deleted = delete_records(deletes)
+                                if deleted is not None:
+                                    if deleted == 0:
+                                        flash(f"⚠️ Entry {entry.get('entry_id')} was already deleted by someone else.",
+                                              kind="warning")
+                                    elif deleted < len(deletes):
+                                        flash(f"⚠️ Entry {entry.get('entry_id')}: {len(deletes) - deleted} of its {len(deletes)} records "
+                                              f"(entry and bids) had already been deleted by someone else.",
+                                              kind="warning")
+                                    else:
+                                        flash(f"✅ Entry {entry.get('entry_id')} deleted successfully.")
+                                    st.session_state[delete_key] = False
+                                    st.rerun()
                             except Exception as e:
                                 st.error(f"❌ Error during deletion: {e}")
                         else:
@@ -4586,9 +6341,9 @@ def placed_bids_page(user, db_local):
         st.rerun()
 
     db_fresh = load_data()
-    bids = filter_bids_by_role(db_fresh.get("bids", []), user)
+    bids = filter_bids_by_role(db_fresh, user)
 
-    for bid in bids:
+    for bid in paginate("bids", bids, key="placed_bids_pager"):
         with st.expander(f"{bid.get('bid_id')} | {bid.get('bidder')} | ₹{bid.get('amount'):,}"):
             st.markdown(f"**Bidder:** {bid.get('bidder')}")
             st.markdown(f"**Entry ID:** {bid.get('entry_id')}")
@@ -4597,31 +6352,20 @@ def placed_bids_page(user, db_local):
             if bid.get("branch"):
                 st.markdown(f"**Branch:** {bid.get('branch')}")
 
-            if bid.get("status", "").upper() == "PLACED":
+            if can_transition("bids", "approve", user.get("role"), bid):
                 col_approve, col_reject = st.columns(2)
 
                 with col_approve:
                     if st.button("✅ Approve", key=f"approve_{bid.get('bid_id')}", type="primary"):
-                        db_fresh = load_data()
-                        for b in db_fresh["bids"]:
-                            if b.get("bid_id") == bid.get("bid_id"):
-                                b["status"] = "APPROVED"
-                        for e in db_fresh["credits_fin_entries"]:
-                            if e.get("entry_id") == bid.get("entry_id"):
-                                e["booked"] = True
-                        save_data(db_fresh)
-                        st.success("✅ Bid approved! Account marked as BOOKED.")
-                        st.rerun()
+                        if apply_transition_one(user, "bids", "approve", bid.get("bid_id")):
+                            flash("✅ Bid approved! Account marked as BOOKED.")
+                            st.rerun()
 
                 with col_reject:
                     if st.button("❌ Reject", key=f"reject_{bid.get('bid_id')}", type="secondary"):
-                        db_fresh = load_data()
-                        for b in db_fresh["bids"]:
-                            if b.get("bid_id") == bid.get("bid_id"):
-                                b["status"] = "REJECTED"
-                        save_data(db_fresh)
-                        st.success("❌ Bid rejected.")
-                        st.rerun()
+                        if apply_transition_one(user, "bids", "reject", bid.get("bid_id")):
+                            flash("❌ Bid rejected.")
+                            st.rerun()
 
 # ====================
 # MAIN ENTRY POINT